@@ -1,8 +1,32 @@
 from . import html_theme
 from . import directives
+from . import katex
+from . import outputs
+from . import profiling
 
 def setup(app):
+    app.connect("doctree-read", html_theme.collect_headings)
+    app.connect("env-purge-doc", html_theme.purge_headings)
+    app.connect("env-merge-info", html_theme.merge_headings)
+    app.connect("env-updated", html_theme.update_booktree)
+    app.connect("env-updated", html_theme.render_sidebars)
+    app.connect("env-updated", html_theme.copy_vendored_assets)
+    app.connect("env-get-updated", html_theme.get_pages_outdated_by_booktree)
     app.connect("html-page-context", html_theme.make_context)
+    app.connect("html-page-context", html_theme.add_sidebar_to_context)
+    app.connect("html-page-context", html_theme.add_assets_to_context)
 
     directives.exercise.setup(app)
     directives.jsfig.setup(app)
+    directives.pyfig.setup(app)
+    katex.setup(app)
+    outputs.setup(app)
+    profiling.setup(app)
+
+    # the extension keeps no global state that page reads or writes depend on, and
+    # merges what it records on the environment from parallel readers
+    return {
+        "env_version": 5,
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
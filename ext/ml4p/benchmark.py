@@ -0,0 +1,428 @@
+"""Measures how the time and memory a build takes grow with the size of the book.
+
+Run from the root of the repository with::
+
+    python -m ml4p.benchmark --sizes 1x2x2 2x4x4 4x6x6
+
+Each size is a number of parts, chapters per part and sections per chapter. For
+each, a synthetic book is generated in the layout of book/ (see
+:func:`generate_book`), with a configurable number of headings, exercises and JS
+figures on every section, and built with the ml4p extension in a fresh process.
+The time of a full build and of a rebuild with nothing changed, and the peak
+memory of the process, are reported against the number of pages.
+
+Static figures are not rendered: genfig's renderer is replaced with a stub that
+returns a made-up image for each figure, so that the benchmark measures the theme,
+the context and the directives rather than a headless browser.
+
+This is a benchmark, not a test: nothing is asserted. Compare its results with
+those of a run before a change to spot regressions.
+
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from typing import Iterator, List, NamedTuple
+
+from sphinx.application import Sphinx
+from sphinx.util.docutils import docutils_namespace, patch_docutils
+
+PROJECT_ROOT = pathlib.Path(__file__).parents[2]
+
+# the figure used by every synthetic jsfig; any figure in /vis/js/figures will do
+FIGURE_NAME = "1d-risk"
+
+# the display size given to every stubbed static figure, in CSS pixels
+STUB_FIGURE_SIZE = (600, 400)
+
+CONF_TEMPLATE = """\
+import sys
+
+sys.path.append({ext!r})
+
+project = "Benchmark"
+extensions = ["ml4p", "sphinxcontrib.katex"]
+
+html_theme = "ml4p"
+html_theme_path = [{ext!r}]
+html_static_path = [{static!r}]
+templates_path = [{templates!r}]
+"""
+
+
+class BookSize(NamedTuple):
+    """The shape of a synthetic book.
+
+    Attributes
+    ----------
+    parts : int
+        The number of parts.
+    chapters : int
+        The number of chapters in each part.
+    sections : int
+        The number of sections in each chapter.
+
+    """
+
+    parts: int
+    chapters: int
+    sections: int
+
+    @classmethod
+    def parse(cls, spec: str) -> "BookSize":
+        """Reads a size written as "<parts>x<chapters>x<sections>", e.g., "2x4x4"."""
+        try:
+            parts, chapters, sections = (int(n) for n in spec.lower().split("x"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f"Invalid size '{spec}'. Must be of the form <parts>x<chapters>x"
+                "<sections>, e.g., 2x4x4."
+            )
+        return cls(parts, chapters, sections)
+
+    @property
+    def pages(self) -> int:
+        """The number of pages, including the root, part and chapter indices."""
+        return 1 + self.parts * (1 + self.chapters * (1 + self.sections))
+
+    def __str__(self):
+        return f"{self.parts}x{self.chapters}x{self.sections}"
+
+
+def _section_source(
+    title: str, headings: int, exercises: int, figures: int, figure_index: int
+) -> str:
+    """The source of a section page.
+
+    Figures alternate between static and dynamic. Each static figure is given
+    options of its own, so that no two share their images.
+
+    """
+    lines = [title, "=" * len(title), ""]
+    for heading in range(1, headings + 1):
+        title = f"Heading {heading}"
+        lines += [
+            title,
+            "-" * len(title),
+            "",
+            "The empirical risk of :math:`h` is "
+            ":math:`R(h) = \\frac{1}{n} \\sum_{i=1}^n (h(x_i) - y_i)^2`.",
+            "",
+        ]
+
+    for _ in range(exercises):
+        lines += [
+            ".. exercise::",
+            "",
+            "   What is :math:`\\vec x \\cdot \\vec y`?",
+            "",
+            "   ---",
+            "",
+            "   It is :math:`\\sum_i x_i y_i`.",
+            "",
+        ]
+
+    for i in range(figures):
+        html_output = "static" if i % 2 == 0 else "dynamic"
+        lines += [
+            f".. jsfig:: {FIGURE_NAME}",
+            f"   :html_output: {html_output}",
+            "",
+            f'   {{"benchmark_figure": {figure_index + i}}}',
+            "",
+        ]
+
+    return "\n".join(lines)
+
+
+def _index_source(title: str, entries: List[str], supertitle: str = None) -> str:
+    lines = []
+    if supertitle is not None:
+        lines += [f":supertitle: {supertitle}", ""]
+    lines += [title, "=" * len(title), "", ".. toctree::", "   :maxdepth: 1", ""]
+    lines += [f"   {entry}" for entry in entries]
+    return "\n".join(lines) + "\n"
+
+
+def generate_book(
+    directory: pathlib.Path,
+    size: BookSize,
+    headings: int = 3,
+    exercises: int = 1,
+    figures: int = 2,
+):
+    """Writes a synthetic book, along with its conf.py, into `directory`.
+
+    The book has the layout of book/: the root index.rst lists the parts, each
+    part is a directory with an index.rst listing its chapters, and each chapter is
+    a directory with an index.rst listing its sections.
+
+    Parameters
+    ----------
+    directory : pathlib.Path
+        The directory to write the book in. It is created if it does not exist.
+    size : BookSize
+        The number of parts, chapters and sections.
+    headings : int, optional
+        The number of headings on each section. Default is 3.
+    exercises : int, optional
+        The number of `exercise` directives on each section. Default is 1.
+    figures : int, optional
+        The number of `jsfig` directives on each section, alternately static and
+        dynamic. Default is 2.
+
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+
+    ext = PROJECT_ROOT / "ext"
+    (directory / "conf.py").write_text(
+        CONF_TEMPLATE.format(
+            ext=str(ext),
+            static=str(ext / "ml4p/html_theme/static"),
+            templates=str(ext / "ml4p/html_theme/templates"),
+        )
+    )
+
+    figure_index = 0
+    parts = []
+    for p in range(1, size.parts + 1):
+        part = f"{p:02d}-part"
+        chapters = []
+        for c in range(1, size.chapters + 1):
+            chapter = f"{c:02d}-chapter"
+            sections = []
+            for s in range(1, size.sections + 1):
+                section = f"{s:02d}-section"
+                path = directory / part / chapter / f"{section}.rst"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(
+                    _section_source(
+                        f"Section {p}.{c}.{s}",
+                        headings,
+                        exercises,
+                        figures,
+                        figure_index,
+                    )
+                )
+                figure_index += figures
+                sections.append(section)
+
+            (directory / part / chapter / "index.rst").write_text(
+                _index_source(f"Chapter {p}.{c}", sections)
+            )
+            chapters.append(f"{chapter}/index")
+
+        (directory / part / "index.rst").write_text(
+            _index_source(f"Part {p}", chapters, supertitle=f"Part {p}")
+        )
+        parts.append(f"{part}/index")
+
+    (directory / "index.rst").write_text(_index_source("Benchmark", parts))
+
+
+@contextlib.contextmanager
+def _stub_figure_renderer() -> Iterator[None]:
+    """Replaces genfig's static renderer with one that renders nothing.
+
+    Every static figure gets a basename derived from its options and a fixed
+    size, and no images are copied to the output.
+
+    """
+    import genfig.js
+    from .directives import jsfig
+
+    def generate_static_many(figures, **kwargs):
+        return [
+            "figure-"
+            + hashlib.md5(
+                json.dumps([str(directory), options], sort_keys=True).encode()
+            ).hexdigest()
+            for directory, options in figures
+        ]
+
+    stubs = [
+        (genfig.js, "generate_static_many", generate_static_many),
+        (genfig.js, "get_static_size", lambda *args: STUB_FIGURE_SIZE),
+        (jsfig, "_copy_static_figure", lambda *args: 0),
+        (jsfig, "_get_driver_pool", lambda app: None),
+        (jsfig, "_get_figure_server", lambda app: None),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in stubs]
+    for module, name, stub in stubs:
+        setattr(module, name, stub)
+    try:
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+
+def _peak_memory_mb() -> float:
+    """The peak resident memory of this process or any of its children, in MB.
+
+    The children are Sphinx's parallel readers and writers, if any.
+
+    """
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # in bytes on macOS, and in kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def _build_once(srcdir: pathlib.Path, build_directory: pathlib.Path, jobs: int):
+    # as in ml4p.serve, each build gets a fresh application, and docutils'
+    # registries are restored after it
+    with patch_docutils(srcdir), docutils_namespace():
+        app = Sphinx(
+            srcdir=str(srcdir),
+            confdir=str(srcdir),
+            outdir=str(build_directory / "html"),
+            doctreedir=str(build_directory / "doctrees"),
+            buildername="html",
+            status=None,
+            parallel=jobs,
+        )
+        app.build()
+
+
+def _build_book(srcdir: pathlib.Path, build_directory: pathlib.Path, jobs: int) -> dict:
+    """Builds the book twice, returning the times of the builds and the peak memory.
+
+    Run in a fresh process, so that the peak memory is that of the build alone.
+
+    """
+    with _stub_figure_renderer():
+        start = time.perf_counter()
+        _build_once(srcdir, build_directory, jobs)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _build_once(srcdir, build_directory, jobs)
+        rebuild_seconds = time.perf_counter() - start
+
+    return {
+        "build_seconds": build_seconds,
+        "rebuild_seconds": rebuild_seconds,
+        "peak_memory_mb": _peak_memory_mb(),
+    }
+
+
+def _build_book_in_child(connection, *args):
+    """Runs :func:`_build_book` in a child process, sending back the result.
+
+    Sends ("ok", result) or, if the build raised, ("error", traceback).
+
+    """
+    try:
+        connection.send(("ok", _build_book(*args)))
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def run_benchmark(
+    sizes: List[BookSize],
+    headings: int = 3,
+    exercises: int = 1,
+    figures: int = 2,
+    jobs: int = 1,
+) -> List[dict]:
+    """Generates and builds a synthetic book of each size.
+
+    Parameters
+    ----------
+    sizes : List[BookSize]
+        The sizes of the books to build.
+    headings, exercises, figures : int, optional
+        The content of each section; see :func:`generate_book`.
+    jobs : int, optional
+        The number of processes Sphinx reads and writes with. Default is 1.
+
+    Returns
+    -------
+    List[dict]
+        For each size, its "size" and number of "pages", the "build_seconds" of a
+        full build and the "rebuild_seconds" of a rebuild with nothing changed, and
+        the "peak_memory_mb" of the process that built it or of its largest worker.
+
+    """
+    # spawned rather than forked, so that each build starts with a fresh process.
+    # Not a pool: its workers are daemonic, and so cannot fork Sphinx's parallel
+    # readers and writers
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="ml4p-benchmark-") as directory:
+            srcdir = pathlib.Path(directory) / "book"
+            generate_book(srcdir, size, headings, exercises, figures)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_build_book_in_child,
+                args=(sender, srcdir, pathlib.Path(directory) / "_build", jobs),
+            )
+            process.start()
+            sender.close()
+            try:
+                status, result = receiver.recv()
+            except EOFError:
+                status, result = "error", f"exit code {process.exitcode}"
+            process.join()
+            if status == "error":
+                raise RuntimeError(f"The build of the {size} book failed:\n{result}")
+        results.append({"size": str(size), "pages": size.pages, **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m ml4p.benchmark",
+        description="Builds synthetic books of increasing size and reports how "
+        "long the builds take and how much memory they use.",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=BookSize.parse,
+        default=[BookSize(1, 2, 2), BookSize(2, 4, 4), BookSize(4, 6, 6)],
+        help="the sizes of the books, as <parts>x<chapters>x<sections>",
+    )
+    parser.add_argument("--headings", type=int, default=3)
+    parser.add_argument("--exercises", type=int, default=1)
+    parser.add_argument("--figures", type=int, default=2)
+    parser.add_argument("--jobs", "-j", type=int, default=1)
+    parser.add_argument("--output", type=pathlib.Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'pages':>6} {'build':>9} {'rebuild':>9} {'memory':>9}")
+    results = []
+    for size in args.sizes:
+        [result] = run_benchmark(
+            [size], args.headings, args.exercises, args.figures, args.jobs
+        )
+        print(
+            f"{result['size']:>10} {result['pages']:>6} "
+            f"{result['build_seconds']:>8.2f}s {result['rebuild_seconds']:>8.2f}s "
+            f"{result['peak_memory_mb']:>6.0f} MB",
+            flush=True,
+        )
+        results.append(result)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
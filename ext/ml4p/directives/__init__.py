@@ -1,2 +1,3 @@
 from . import exercise
 from . import jsfig
+from . import pyfig
@@ -0,0 +1,45 @@
+"""Provides `make_node_id()` for giving directive nodes deterministic HTML ids."""
+import hashlib
+
+from docutils.parsers.rst import Directive
+
+
+def make_node_id(directive: Directive, prefix: str) -> str:
+    """Derives an HTML id for the node created by a directive.
+
+    The id is a hash of the document's name, the directive's line number, its
+    arguments and its content, so rebuilding an unchanged page produces identical
+    HTML. In the unlikely event that two directives in the same document hash to
+    the same id, the later one gets a numeric suffix.
+
+    Parameters
+    ----------
+    directive : Directive
+        The directive being run.
+    prefix : str
+        Begins the id, e.g., "ml4p-exercise". Since the id may be used in CSS
+        selectors, it must not begin with a digit.
+
+    Returns
+    -------
+    str
+        The id, e.g., "ml4p-exercise-1f3870be274f".
+
+    """
+    env = directive.state.document.settings.env
+    digest = hashlib.md5(env.docname.encode())
+    digest.update(str(directive.lineno).encode())
+    digest.update("\n".join(directive.arguments).encode())
+    digest.update("\n".join(directive.content).encode())
+    node_id = f"{prefix}-{digest.hexdigest()[:12]}"
+
+    # temp_data is reset for each document that is read
+    used = env.temp_data.setdefault("ml4p_node_ids", set())
+    unique_id = node_id
+    suffix = 1
+    while unique_id in used:
+        suffix += 1
+        unique_id = f"{node_id}-{suffix}"
+    used.add(unique_id)
+
+    return unique_id
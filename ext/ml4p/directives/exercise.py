@@ -1,9 +1,11 @@
 """Provides a directive for exercise questions."""
-import uuid
 
 from docutils.parsers.rst import Directive
 from docutils import nodes
 
+from ..profiling import timed_visitor
+from ._ids import make_node_id
+
 class ExerciseNode(nodes.General, nodes.Element):
     pass
 
@@ -30,7 +32,7 @@ class ExerciseDirective(Directive):
         question_lines = self.content[:split_index]
         answer_lines = self.content[split_index + 1:]
 
-        id = str(uuid.uuid4())
+        id = make_node_id(self, "ml4p-exercise")
 
         # create QuestionNode
         question_node = QuestionNode(id)
@@ -47,6 +49,7 @@ class ExerciseDirective(Directive):
         return [exercise]
 
 
+@timed_visitor("ml4p.exercise.visit")
 def html_visit_exercise_node(self, node):
     self.body.append(self.starttag(node, 'div', CLASS='exercise'))
     self.body.append('<div class="exercise-title">\n')
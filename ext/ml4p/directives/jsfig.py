@@ -1,21 +1,40 @@
 """Provides a directive for displaying JavaScript figures."""
 import json
+import os
 import pathlib
-import uuid
 import shutil
 from string import Template
+from typing import List, Set, Tuple
 
 from docutils.parsers.rst import Directive, directives
 from docutils import nodes
+from sphinx.util import logging
 
 import genfig.js
 
+from ..profiling import timed, timed_visitor
+from ._ids import make_node_id
+
 # the root of the project
 PROJECT_ROOT = pathlib.Path(__file__).parent.parent.parent.parent
 
 # the directory containing the JS figures
 FIGURES_ROOT = PROJECT_ROOT / "vis/js/figures"
 
+# the p5 library, which the theme loads on pages with dynamic figures
+P5_PATH = (PROJECT_ROOT / "vis/js/lib/p5/p5.min.js").resolve()
+
+# the module that mounts dynamic figures, which every page with one imports
+ML4P_MAIN_PATH = (PROJECT_ROOT / "vis/js/lib/ml4p/main.js").resolve()
+
+logger = logging.getLogger(__name__)
+
+# the pool of headless browsers and the server used to render static figures. They
+# are created on first use so that builds without static figures never launch a
+# browser, and are shut down when the build finishes
+_driver_pool = None
+_figure_server = None
+
 
 class JSFigureNode(nodes.General, nodes.Element):
     def __init__(
@@ -57,7 +76,7 @@ class JSFigureDirective(Directive):
     has_content = True
 
     def run(self):
-        id = str(uuid.uuid4())
+        id = make_node_id(self, "ml4p-jsfig")
         figure_options_json = "\n".join(self.content).strip()
         figure_options_json = "{}" if not figure_options_json else figure_options_json
         figure_node = JSFigureNode(
@@ -71,19 +90,26 @@ class JSFigureDirective(Directive):
 
 
 def _generate_html_for_dynamic_figure(self, node):
+    # the figure's module is imported, and its sketch started, only once the figure
+    # approaches the viewport; see mountDynamic in /vis/js/lib/ml4p/main.js
     html_template = Template(
         """
     <script defer type="module">
-      import { setup_dynamic } from "/_static/vis/js/figures/$figure_name/main.js";
+      import { mountDynamic } from "/_static/vis/js/lib/ml4p/main.js";
 
       function getTheme() {
         return document.documentElement.getAttribute("data-bs-theme");
       }
 
-      setup_dynamic(
+      mountDynamic(
         "$div_id",
-        getTheme,
-        $figure_options_json,
+        async function () {
+          const { setup_dynamic } = await import(
+            "/_static/vis/js/figures/$figure_name/main.js"
+          );
+          return setup_dynamic("$div_id", getTheme, $figure_options_json);
+        },
+        { maxLive: $max_live },
       );
     </script>
 
@@ -96,60 +122,421 @@ def _generate_html_for_dynamic_figure(self, node):
         div_id=node.id,
         figure_options_json=node.figure_options_json,
         align=node.align,
+        max_live=self.builder.config.ml4p_dynamic_max_live,
     )
 
 
-def _generate_static_figures(self, node):
+def _get_driver_pool(app) -> genfig.js.DriverPool:
+    global _driver_pool
+    if _driver_pool is None:
+        _driver_pool = genfig.js.DriverPool(
+            size=app.config.ml4p_static_pool_size,
+            max_renders=app.config.ml4p_static_max_renders,
+        )
+    return _driver_pool
+
+
+def _get_figure_server(app) -> genfig.js.FigureServer:
+    global _figure_server
+    if _figure_server is None:
+        _figure_server = genfig.js.FigureServer(FIGURES_ROOT.parent)
+        _figure_server.start()
+    return _figure_server
+
+
+def _shutdown_static_renderer(app, exception):
+    global _driver_pool, _figure_server
+    if _driver_pool is not None:
+        _driver_pool.close()
+        _driver_pool = None
+    if _figure_server is not None:
+        _figure_server.stop()
+        _figure_server = None
+
+
+def _static_figure_key(node: JSFigureNode) -> Tuple[str, str]:
+    """The (figure, options) pair identifying the static images of a node.
+
+    The options are normalized so that equivalent JSON produces the same key.
+
+    """
     figure_options = json.loads(node.figure_options_json)
-    figbasename = genfig.js.generate_static(
-        FIGURES_ROOT / node.figure_name, figure_options
+    return node.figure_name, json.dumps(figure_options, sort_keys=True)
+
+
+def _collect_static_figures(app, doctree):
+    """Records the static figures used by the document that was just read."""
+    env = app.env
+    if not hasattr(env, "ml4p_static_figures"):
+        env.ml4p_static_figures = {}
+
+    keys = {
+        _static_figure_key(node)
+        for node in doctree.traverse(JSFigureNode)
+        if node.html_output == "static"
+    }
+
+    if keys:
+        env.ml4p_static_figures[env.docname] = keys
+    else:
+        env.ml4p_static_figures.pop(env.docname, None)
+
+
+def _purge_static_figures(app, env, docname):
+    if hasattr(env, "ml4p_static_figures"):
+        env.ml4p_static_figures.pop(docname, None)
+
+
+def _merge_static_figures(app, env, docnames, other):
+    """Merges the figures recorded by a parallel reader into the main environment."""
+    if not hasattr(env, "ml4p_static_figures"):
+        env.ml4p_static_figures = {}
+    for docname, keys in getattr(other, "ml4p_static_figures", {}).items():
+        if docname in docnames:
+            env.ml4p_static_figures[docname] = keys
+
+
+def _collect_dynamic_figures(app, doctree):
+    """Records the dynamic figures used by the document that was just read.
+
+    Only pages with dynamic figures load p5 and the figures' modules; see
+    extrahead.html.
+
+    """
+    env = app.env
+    if not hasattr(env, "ml4p_dynamic_figures"):
+        env.ml4p_dynamic_figures = {}
+
+    figure_names = {
+        node.figure_name
+        for node in doctree.traverse(JSFigureNode)
+        if node.html_output == "dynamic"
+    }
+
+    if figure_names:
+        env.ml4p_dynamic_figures[env.docname] = figure_names
+    else:
+        env.ml4p_dynamic_figures.pop(env.docname, None)
+
+
+def _purge_dynamic_figures(app, env, docname):
+    if hasattr(env, "ml4p_dynamic_figures"):
+        env.ml4p_dynamic_figures.pop(docname, None)
+
+
+def _merge_dynamic_figures(app, env, docnames, other):
+    """Merges the figures recorded by a parallel reader into the main environment."""
+    if not hasattr(env, "ml4p_dynamic_figures"):
+        env.ml4p_dynamic_figures = {}
+    for docname, figure_names in getattr(other, "ml4p_dynamic_figures", {}).items():
+        if docname in docnames:
+            env.ml4p_dynamic_figures[docname] = figure_names
+
+
+def _add_dynamic_figures_to_context(app, pagename, templatename, context, doctree):
+    """Provides the names of the page's dynamic figures to the templates.
+
+    Connected to the `html-page-context` event.
+
+    """
+    figure_names = getattr(app.env, "ml4p_dynamic_figures", {}).get(pagename, ())
+    context["ml4p_dynamic_figures"] = sorted(figure_names)
+
+
+def _get_static_formats(config) -> List[str]:
+    """The configured image formats that this Pillow supports, PNG always last.
+
+    PNG is the fallback for browsers that support none of the other formats, so it
+    is always generated.
+
+    """
+    supported = genfig.js.supported_formats()
+    formats = [fmt for fmt in config.ml4p_static_formats if fmt in supported]
+    if "png" in formats:
+        formats.remove("png")
+    return formats + ["png"]
+
+
+def _sync_file(source: pathlib.Path, destination: pathlib.Path) -> bool:
+    """Copies the file unless the destination has the same contents.
+
+    Returns whether the file was copied. Unchanged files keep their modification
+    times, so that caches and deploys relying on them are not invalidated.
+
+    """
+    if (
+        destination.exists()
+        and destination.stat().st_size == source.stat().st_size
+        and destination.read_bytes() == source.read_bytes()
+    ):
+        return False
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(source, destination)
+    return True
+
+
+def _static_image_filenames(config, figbasename: str) -> List[str]:
+    """The filenames of every image of a static figure, in every theme and format."""
+    return [
+        genfig.js.static_image_filename(figbasename, theme, pixel_ratio, image_format)
+        for theme in ["light", "dark"]
+        for pixel_ratio in config.ml4p_static_pixel_ratios
+        for image_format in _get_static_formats(config)
+    ]
+
+
+def _copy_static_figure(app, figure_name: str, figbasename: str) -> int:
+    """Copies the figure's images to the output, returning how many were copied.
+
+    Images already in the output are not copied again; see `_sync_file`.
+
+    """
+    outdir = pathlib.Path(app.builder.outdir) / f"_static/vis/js/figures/{figure_name}"
+    sourcedir = FIGURES_ROOT / figure_name / "_build"
+
+    copied = 0
+    for filename in _static_image_filenames(app.config, figbasename):
+        copied += _sync_file(sourcedir / filename, outdir / filename)
+    return copied
+
+
+@timed("ml4p.jsfig.render_static")
+def _render_static_figures(app, env):
+    """Renders every static figure in the book before the HTML is written.
+
+    The distinct (figure, options) pairs used anywhere in the book are rendered
+    concurrently, and the resulting basenames and display sizes are stored in
+    `env.ml4p_rendered_static_figures` so that the visitor only has to look them up.
+
+    """
+    env.ml4p_rendered_static_figures = {}
+    if app.builder.format != "html":
+        return
+
+    keys = set()
+    for doc_keys in getattr(env, "ml4p_static_figures", {}).values():
+        keys |= doc_keys
+    keys = sorted(keys)
+
+    if not keys:
+        return
+
+    supported = genfig.js.supported_formats()
+    for fmt in app.config.ml4p_static_formats:
+        if fmt not in supported:
+            logger.warning(
+                f"Pillow cannot write '{fmt}' images; static figures will not be "
+                "available in this format."
+            )
+
+    logger.info(f"rendering {len(keys)} static figures...")
+    figbasenames = genfig.js.generate_static_many(
+        [
+            (FIGURES_ROOT / figure_name, json.loads(options_json))
+            for figure_name, options_json in keys
+        ],
+        capture=app.config.ml4p_static_capture,
+        formats=_get_static_formats(app.config),
+        pixel_ratios=app.config.ml4p_static_pixel_ratios,
+        pool=_get_driver_pool(app),
+        server=_get_figure_server(app),
     )
 
-    # copy the figure to the output
-    outdir = (
-        pathlib.Path(self.builder.outdir) / f"_static/vis/js/figures/{node.figure_name}"
+    copied = 0
+    for (figure_name, options_json), figbasename in zip(keys, figbasenames):
+        copied += _copy_static_figure(app, figure_name, figbasename)
+        size = genfig.js.get_static_size(FIGURES_ROOT / figure_name, figbasename)
+        env.ml4p_rendered_static_figures[(figure_name, options_json)] = (
+            figbasename,
+            size,
+        )
+    logger.info(f"copied {copied} static figure images to the output")
+
+
+def _figure_files(
+    hasher: genfig.js.SourceHasher, figure_name: str
+) -> Set[pathlib.Path]:
+    """The files a dynamic figure needs: its directory and the modules it imports.
+
+    As with the figure's sources, Makefiles, executables and _build directories are
+    left out.
+
+    """
+    figure_directory = (FIGURES_ROOT / figure_name).resolve()
+    files = set(hasher.module_files(figure_directory))
+    for path in figure_directory.rglob("*"):
+        relative = path.relative_to(figure_directory)
+        if (
+            "_build" in relative.parts
+            or not path.is_file()
+            or path.name == "Makefile"
+            or os.access(path, os.X_OK)
+        ):
+            continue
+        files.add(path)
+    return files
+
+
+def _prune_outputs(outdir: pathlib.Path, keep: Set[pathlib.Path]) -> int:
+    """Removes the files in `outdir` that are not in `keep`, and empty directories.
+
+    Returns the number of files removed.
+
+    """
+    removed = 0
+    for directory, _, filenames in os.walk(outdir, topdown=False):
+        directory = pathlib.Path(directory)
+        for filename in filenames:
+            if directory / filename not in keep:
+                (directory / filename).unlink()
+                removed += 1
+        if directory != outdir and not any(directory.iterdir()):
+            directory.rmdir()
+    return removed
+
+
+@timed("ml4p.jsfig.sync_dynamic")
+def _sync_dynamic_figures(app, exception):
+    """Copies the sources of the book's dynamic figures into _static/vis/js.
+
+    Only the figures used by the book are copied, along with p5 and the modules in
+    /vis/js/lib that they or the pages import. Files whose contents have not changed
+    are not copied again. Files left by earlier builds that are neither the sources
+    of a dynamic figure nor the images of a static figure are removed, so that
+    figures which are no longer used do not linger in the output.
+
+    Connected to the `build-finished` event.
+
+    """
+    if exception is not None or app.builder.format != "html":
+        return
+
+    figure_names = set()
+    for doc_figure_names in getattr(app.env, "ml4p_dynamic_figures", {}).values():
+        figure_names |= doc_figure_names
+
+    files = set()
+    if figure_names:
+        hasher = genfig.js.SourceHasher(FIGURES_ROOT.parent)
+        files = {P5_PATH, *hasher.module_files(ML4P_MAIN_PATH.parent)}
+        for figure_name in sorted(figure_names):
+            files |= _figure_files(hasher, figure_name)
+
+    js_root = FIGURES_ROOT.parent.resolve()
+    outdir = pathlib.Path(app.builder.outdir) / "_static/vis/js"
+    keep = set()
+    copied = 0
+    for path in sorted(files):
+        if not path.is_relative_to(js_root):
+            logger.warning(f"{path} is imported by a figure but is not in /vis/js.")
+            continue
+        destination = outdir / path.relative_to(js_root)
+        copied += _sync_file(path, destination)
+        keep.add(destination)
+
+    rendered = getattr(app.env, "ml4p_rendered_static_figures", {})
+    for (figure_name, _), (figbasename, _) in rendered.items():
+        for filename in _static_image_filenames(app.config, figbasename):
+            keep.add(outdir / "figures" / figure_name / filename)
+
+    removed = _prune_outputs(outdir, keep) if outdir.exists() else 0
+
+    logger.info(
+        f"copied {copied} of the {len(files)} files of {len(figure_names)} dynamic "
+        f"figures; removed {removed} unused files"
     )
-    outdir.mkdir(parents=True, exist_ok=True)
-    sourcedir = FIGURES_ROOT / node.figure_name / "_build"
 
-    shutil.copy(
-        sourcedir / f"{figbasename}-dark.png", outdir / f"{figbasename}-dark.png"
+
+def _make_srcset(
+    self, url_directory: str, figbasename: str, image_format: str, width: int
+) -> str:
+    """Lists the images of each pixel ratio, described by their widths."""
+    candidates = []
+    for pixel_ratio in self.builder.config.ml4p_static_pixel_ratios:
+        filename = genfig.js.static_image_filename(
+            figbasename, "dark", pixel_ratio, image_format
+        )
+        url = f"{url_directory}/{filename}"
+        candidates.append(f"{url} {round(pixel_ratio * width)}w")
+    return ", ".join(candidates)
+
+
+def _generate_html_for_static_figure(
+    self, node, url_directory: str, figbasename: str, size
+):
+    """Displays the generated images of a figure, whether JS or Python.
+
+    `url_directory` is the URL of the directory the images were copied to.
+
+    """
+    width, height = size
+
+    # the figure is displayed at its natural width, unless the viewport is narrower
+    sizes = f"(max-width: {width}px) 100vw, {width}px"
+
+    # each format other than PNG is offered as a <source>, in order of preference;
+    # browsers that support none of them fall back to the PNGs in the <img>
+    source_template = Template(
+        """<source type="image/$image_format" srcset="$srcset" sizes="$sizes">"""
     )
-    shutil.copy(
-        sourcedir / f"{figbasename}-light.png", outdir / f"{figbasename}-light.png"
+    formats = _get_static_formats(self.builder.config)
+    sources = "\n".join(
+        source_template.substitute(
+            image_format=image_format,
+            srcset=_make_srcset(self, url_directory, figbasename, image_format, width),
+            sizes=sizes,
+        )
+        for image_format in formats[:-1]
     )
 
-    return figbasename
-
+    largest_pixel_ratio = max(self.builder.config.ml4p_static_pixel_ratios)
+    src = genfig.js.static_image_filename(
+        figbasename, "dark", largest_pixel_ratio, "png"
+    )
 
-def _generate_html_for_static_figure(self, node, figbasename: str):
-    html_template = Template(
-        """
+    html_template = Template("""
         <div class="text-$align" id="$div_id">
-            <img
-                src="/_static/vis/js/figures/$figure_name/$figbasename-dark.png"
-                class="ml4p-figure ml4p-figure-generated-static"
-                style="display: none;"
-                onload="initializeGeneratedImage(this); this.style.display = 'block';"
-            >
+            <picture>
+                $sources
+                <img
+                    src="$url_directory/$src"
+                    srcset="$srcset"
+                    sizes="$sizes"
+                    width="$width"
+                    height="$height"
+                    class="ml4p-figure ml4p-figure-generated-static"
+                    style="display: none;"
+                    onload="initializeGeneratedImage(this); this.style.display = 'block';"
+                >
+            </picture>
         </div>
-        """
-    )
+        """)
 
     return html_template.substitute(
-        figure_name=node.figure_name,
-        figbasename=figbasename,
+        url_directory=url_directory,
+        sources=sources,
+        src=src,
+        srcset=_make_srcset(self, url_directory, figbasename, "png", width),
+        sizes=sizes,
+        width=width,
+        height=height,
         div_id=node.id,
         align=node.align,
     )
 
 
+@timed_visitor("ml4p.jsfig.visit")
 def visit_jsfigure_node(self, node):
     if node.html_output == "dynamic":
         html = _generate_html_for_dynamic_figure(self, node)
     else:
-        figbasename = _generate_static_figures(self, node)
-        html = _generate_html_for_static_figure(self, node, figbasename)
+        figbasename, size = self.builder.env.ml4p_rendered_static_figures[
+            _static_figure_key(node)
+        ]
+        url_directory = f"/_static/vis/js/figures/{node.figure_name}"
+        html = _generate_html_for_static_figure(
+            self, node, url_directory, figbasename, size
+        )
     self.body.append(html)
 
 
@@ -158,5 +545,34 @@ def depart_jsfigure_node(self, node):
 
 
 def setup(app):
+    # the number of headless browsers used to render static figures in parallel,
+    # and the number of renders each performs before it is replaced with a fresh one
+    app.add_config_value("ml4p_static_pool_size", os.cpu_count() or 1, "")
+    app.add_config_value("ml4p_static_max_renders", 50, "")
+
+    # how static figures are captured: "screenshot" or "canvas"; see
+    # genfig.js.generate_static
+    app.add_config_value("ml4p_static_capture", "screenshot", "html")
+
+    # the formats static figures are offered in, in order of preference, and the
+    # device pixel ratios they are rendered at; see genfig.js.generate_static
+    app.add_config_value("ml4p_static_formats", ["webp", "png"], "html")
+    app.add_config_value("ml4p_static_pixel_ratios", [1, 2], "html")
+
+    # the maximum number of dynamic figures on a page whose sketches are mounted at
+    # once, or 0 for no limit. Figures are always mounted only as they approach the
+    # viewport and paused while offscreen
+    app.add_config_value("ml4p_dynamic_max_live", 0, "html")
+
     app.add_directive("jsfig", JSFigureDirective)
     app.add_node(JSFigureNode, html=(visit_jsfigure_node, depart_jsfigure_node))
+    app.connect("doctree-read", _collect_static_figures)
+    app.connect("env-purge-doc", _purge_static_figures)
+    app.connect("env-merge-info", _merge_static_figures)
+    app.connect("doctree-read", _collect_dynamic_figures)
+    app.connect("env-purge-doc", _purge_dynamic_figures)
+    app.connect("env-merge-info", _merge_dynamic_figures)
+    app.connect("html-page-context", _add_dynamic_figures_to_context)
+    app.connect("env-updated", _render_static_figures)
+    app.connect("build-finished", _sync_dynamic_figures)
+    app.connect("build-finished", _shutdown_static_renderer)
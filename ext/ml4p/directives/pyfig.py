@@ -0,0 +1,227 @@
+"""Provides a directive for displaying Python (matplotlib) figures."""
+import json
+import os
+import pathlib
+from typing import Tuple
+
+from docutils.parsers.rst import Directive, directives
+from docutils import nodes
+from sphinx.util import logging
+
+import genfig.py
+
+from ..profiling import timed, timed_visitor
+from ._ids import make_node_id
+from .jsfig import (
+    PROJECT_ROOT,
+    _generate_html_for_static_figure,
+    _get_static_formats,
+    _sync_file,
+)
+
+# the directory containing the Python figures
+FIGURES_ROOT = PROJECT_ROOT / "vis/py"
+
+logger = logging.getLogger(__name__)
+
+# the pool of warm worker processes used to render the figures. It is started on
+# first use, so builds without Python figures never import matplotlib, and is
+# closed when the build finishes
+_worker_pool = None
+
+
+class PyFigureNode(nodes.General, nodes.Element):
+    def __init__(
+        self,
+        id: str,
+        figure_name: str,
+        figure_options_json: str,
+        align="center",
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.id = id
+        self.figure_name = figure_name
+        self.align = align
+        self.figure_options_json = figure_options_json
+
+
+class PyFigureDirective(Directive):
+    """Displays a figure drawn by the `setup()` function of /vis/py/<name>/main.py.
+
+    The content of the directive, if any, is a JSON object whose entries are passed
+    to `setup()` as keyword arguments. Python figures are always static.
+
+    """
+
+    required_arguments = 1
+    optional_arguments = 1
+    option_spec = {
+        "align": directives.unchanged,
+    }
+    final_argument_whitespace = True
+    has_content = True
+
+    def run(self):
+        id = make_node_id(self, "ml4p-pyfig")
+        figure_options_json = "\n".join(self.content).strip()
+        figure_options_json = "{}" if not figure_options_json else figure_options_json
+        figure_node = PyFigureNode(
+            id,
+            self.arguments[0],
+            figure_options_json,
+            align=self.options.get("align", "center"),
+        )
+        return [figure_node]
+
+
+def _py_figure_key(node: PyFigureNode) -> Tuple[str, str]:
+    """The (figure, options) pair identifying the images of a node."""
+    figure_options = json.loads(node.figure_options_json)
+    return node.figure_name, json.dumps(figure_options, sort_keys=True)
+
+
+def _collect_py_figures(app, doctree):
+    """Records the Python figures used by the document that was just read."""
+    env = app.env
+    if not hasattr(env, "ml4p_py_figures"):
+        env.ml4p_py_figures = {}
+
+    keys = {_py_figure_key(node) for node in doctree.traverse(PyFigureNode)}
+
+    if keys:
+        env.ml4p_py_figures[env.docname] = keys
+    else:
+        env.ml4p_py_figures.pop(env.docname, None)
+
+
+def _purge_py_figures(app, env, docname):
+    if hasattr(env, "ml4p_py_figures"):
+        env.ml4p_py_figures.pop(docname, None)
+
+
+def _merge_py_figures(app, env, docnames, other):
+    """Merges the figures recorded by a parallel reader into the main environment."""
+    if not hasattr(env, "ml4p_py_figures"):
+        env.ml4p_py_figures = {}
+    for docname, keys in getattr(other, "ml4p_py_figures", {}).items():
+        if docname in docnames:
+            env.ml4p_py_figures[docname] = keys
+
+
+def _get_worker_pool(app) -> genfig.py.WorkerPool:
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = genfig.py.WorkerPool(size=app.config.ml4p_py_max_workers)
+    return _worker_pool
+
+
+def _shutdown_worker_pool(app, exception):
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool = None
+
+
+def _log_py_figure_progress(
+    done, total, figure_directory, figure_options, seconds, error
+):
+    status = "failed" if error is not None else f"{seconds:.2f}s"
+    logger.verbose(f"[{done}/{total}] {figure_directory.name}: {status}")
+
+
+def _copy_py_figure(app, figure_name: str, figbasename: str) -> int:
+    outdir = pathlib.Path(app.builder.outdir) / f"_static/vis/py/{figure_name}"
+    sourcedir = FIGURES_ROOT / figure_name / "_build"
+
+    copied = 0
+    for theme in ["light", "dark"]:
+        for pixel_ratio in app.config.ml4p_static_pixel_ratios:
+            for image_format in _get_static_formats(app.config):
+                filename = genfig.py.static_image_filename(
+                    figbasename, theme, pixel_ratio, image_format
+                )
+                copied += _sync_file(sourcedir / filename, outdir / filename)
+    return copied
+
+
+@timed("ml4p.pyfig.render")
+def _render_py_figures(app, env):
+    """Renders every Python figure in the book before the HTML is written.
+
+    The distinct (figure, options) pairs are rendered concurrently in worker
+    processes, and the resulting basenames and display sizes are stored in
+    `env.ml4p_rendered_py_figures`.
+
+    """
+    env.ml4p_rendered_py_figures = {}
+    if app.builder.format != "html":
+        return
+
+    keys = set()
+    for doc_keys in getattr(env, "ml4p_py_figures", {}).values():
+        keys |= doc_keys
+    keys = sorted(keys)
+
+    if not keys:
+        return
+
+    logger.info(f"rendering {len(keys)} Python figures...")
+    figbasenames = genfig.py.generate_static_many(
+        [
+            (FIGURES_ROOT / figure_name, json.loads(options_json))
+            for figure_name, options_json in keys
+        ],
+        formats=_get_static_formats(app.config),
+        pixel_ratios=app.config.ml4p_static_pixel_ratios,
+        progress=_log_py_figure_progress,
+        workers=_get_worker_pool(app),
+    )
+
+    startup_times = _get_worker_pool(app).startup_times.values()
+    if startup_times:
+        logger.info(
+            f"started {len(startup_times)} Python figure workers; importing the "
+            f"plotting libraries took at most {max(startup_times):.2f}s"
+        )
+
+    copied = 0
+    for (figure_name, options_json), figbasename in zip(keys, figbasenames):
+        copied += _copy_py_figure(app, figure_name, figbasename)
+        size = genfig.py.get_static_size(FIGURES_ROOT / figure_name, figbasename)
+        env.ml4p_rendered_py_figures[(figure_name, options_json)] = (
+            figbasename,
+            size,
+        )
+    logger.info(f"copied {copied} Python figure images to the output")
+
+
+@timed_visitor("ml4p.pyfig.visit")
+def visit_pyfigure_node(self, node):
+    figbasename, size = self.builder.env.ml4p_rendered_py_figures[
+        _py_figure_key(node)
+    ]
+    url_directory = f"/_static/vis/py/{node.figure_name}"
+    html = _generate_html_for_static_figure(
+        self, node, url_directory, figbasename, size
+    )
+    self.body.append(html)
+
+
+def depart_pyfigure_node(self, node):
+    pass
+
+
+def setup(app):
+    # the number of processes used to render Python figures in parallel. The image
+    # formats and pixel ratios are shared with the static JS figures
+    app.add_config_value("ml4p_py_max_workers", os.cpu_count() or 1, "")
+
+    app.add_directive("pyfig", PyFigureDirective)
+    app.add_node(PyFigureNode, html=(visit_pyfigure_node, depart_pyfigure_node))
+    app.connect("doctree-read", _collect_py_figures)
+    app.connect("env-purge-doc", _purge_py_figures)
+    app.connect("env-merge-info", _merge_py_figures)
+    app.connect("env-updated", _render_py_figures)
+    app.connect("build-finished", _shutdown_worker_pool)
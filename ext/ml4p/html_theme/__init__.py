@@ -1 +1,10 @@
-from .context import make_context
+from .context import (
+    make_context,
+    update_booktree,
+    get_pages_outdated_by_booktree,
+    collect_headings,
+    purge_headings,
+    merge_headings,
+)
+from .sidebar import render_sidebars, add_sidebar_to_context
+from .assets import copy_vendored_assets, add_assets_to_context
@@ -0,0 +1,90 @@
+"""Serves the vendored third-party assets from the book's _static directory."""
+import hashlib
+import pathlib
+import shutil
+from typing import Dict
+
+import genfig.vendor
+
+from ..profiling import timed
+
+# the assets vendored by `genfig vendor`
+VENDOR_DIRECTORY = (
+    pathlib.Path(__file__).parents[3] / "vis/js" / genfig.vendor.VENDOR_DIRECTORY
+)
+
+# the vendored assets are copied here, relative to the output directory
+OUTPUT_DIRECTORY = "_static/vendor"
+
+# the path of the copy of each vendored asset, relative to the output directory, by
+# the asset's CDN URL. Set at env-updated and read by every page render; parallel
+# writers inherit it when they are forked
+_asset_paths: Dict[str, str] = {}
+
+
+def _fingerprint(directory: pathlib.Path) -> str:
+    """A hash of the names and contents of the files in a directory."""
+    digest = hashlib.md5()
+    for path in sorted(p for p in directory.rglob("*") if p.is_file()):
+        digest.update(path.relative_to(directory).as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:10]
+
+
+@timed("ml4p.copy_vendored_assets")
+def copy_vendored_assets(app, env):
+    """Copies each vendored package to the output under a content-hashed name.
+
+    A package named, e.g., "katex@0.16.10" is copied to
+    _static/vendor/katex@0.16.10-<hash>, so any change to its files changes every
+    URL into it and the copies can be served with long-lived cache headers. A copy
+    that already exists is left alone, and copies of old versions are removed.
+    Assets that have not been vendored are loaded from their CDNs instead.
+
+    Connected to the `env-updated` event.
+
+    """
+    _asset_paths.clear()
+    if app.builder.format != "html":
+        return
+
+    outdir = pathlib.Path(app.builder.outdir) / OUTPUT_DIRECTORY
+    copies = {}
+    for asset in genfig.vendor.VENDORED_ASSETS:
+        path = genfig.vendor.vendored_path(VENDOR_DIRECTORY, asset.url)
+        if path is None:
+            continue
+
+        package, _, rest = path.partition("/")
+        if package not in copies:
+            copies[package] = f"{package}-{_fingerprint(VENDOR_DIRECTORY / package)}"
+            destination = outdir / copies[package]
+            if not destination.exists():
+                shutil.copytree(VENDOR_DIRECTORY / package, destination)
+
+        _asset_paths[asset.url] = f"{OUTPUT_DIRECTORY}/{copies[package]}/{rest}"
+
+    if outdir.exists():
+        for copy in outdir.iterdir():
+            if copy.name not in copies.values():
+                shutil.rmtree(copy)
+
+
+def add_assets_to_context(app, pagename, templatename, context, doctree):
+    """Provides `ml4p_asset(url)` to the templates; see extrahead.html.
+
+    `ml4p_asset` returns the URL of the vendored copy of the asset at a CDN URL,
+    relative to the page, or the CDN URL itself if the asset is not vendored.
+
+    Connected to the `html-page-context` event.
+
+    """
+    pathto = context["pathto"]
+
+    def ml4p_asset(url: str) -> str:
+        if url in _asset_paths:
+            return pathto(_asset_paths[url], 1)
+        return url
+
+    context["ml4p_asset"] = ml4p_asset
+    context["ml4p_assets_vendored"] = bool(_asset_paths)
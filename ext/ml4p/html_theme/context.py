@@ -1,9 +1,11 @@
 """Populates the HTML templating context."""
-from typing import Union, Optional, Sequence, List
+from typing import Iterator, Union, Optional, Sequence, List, Tuple
 
 from sphinx.errors import ExtensionError
 from docutils.nodes import section
 
+from ..profiling import timed, timed_page_handler, timed_reader
+
 
 class PageInfo:
     """Contains information about a book page.
@@ -38,9 +40,33 @@ class PageInfo:
         The previous page in the book, if any.
     number: Optional[int]
         The number of the page within its parent, if any.
+    is_index : bool
+        Whether the page is an index page (at any level).
+    is_part_index : bool
+        Whether the page is a part index page.
+    is_chapter_index : bool
+        Whether the page is a chapter index page.
+    is_section : bool
+        Whether the page is a section page.
+    is_supplement : bool
+        Whether the page is a supplement page.
 
     """
 
+    __slots__ = (
+        "title",
+        "key",
+        "parent",
+        "next",
+        "prev",
+        "number",
+        "is_index",
+        "is_part_index",
+        "is_chapter_index",
+        "is_section",
+        "is_supplement",
+    )
+
     def __init__(
         self,
         title: str,
@@ -57,38 +83,35 @@ class PageInfo:
         self.prev = prev
         self.number = number
 
-    @property
-    def is_index(self):
-        """Whether the page is an index page (at any level)."""
-        return self.key.endswith("/index")
-
-    @property
-    def is_part_index(self):
-        """Whether the page is a part index page."""
-        parts = self.key.split("/")
-        return len(parts) == 2 and parts[-1] == "index"
-
-    @property
-    def is_chapter_index(self):
-        """Whether the page is a chapter index page."""
-        parts = self.key.split("/")
-        return len(parts) == 3 and parts[-1] == "index"
-
-    @property
-    def is_section(self):
-        """Whether the page is a section page."""
-        parts = self.key.split("/")
-        return not self.is_index and len(parts) == 3
-
-    @property
-    def is_supplement(self):
-        """Whether the page is a supplement page."""
-        return not self.is_index and not self.is_section
+        # the type of the page depends only on its key, so it is computed once here
+        # rather than every time the templates ask
+        parts = key.split("/")
+        self.is_index = parts[-1] == "index"
+        self.is_part_index = len(parts) == 2 and self.is_index
+        self.is_chapter_index = len(parts) == 3 and self.is_index
+        self.is_section = not self.is_index and len(parts) == 3
+        self.is_supplement = not self.is_index and not self.is_section
 
     def is_active(self, docname: str):
         """Whether this page is the active page."""
         return docname == self.key
 
+    def __getstate__(self):
+        # the next and prev pointers are left out: following them when pickling
+        # recurses once per page, which overflows the stack for large books. They
+        # are restored by BookTree when it is unpickled
+        return {
+            slot: getattr(self, slot)
+            for slot in self.__slots__
+            if slot not in ("next", "prev")
+        }
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self.next = None
+        self.prev = None
+
     @classmethod
     def from_app_env(cls, env, docname: str, parent, number: Optional[int] = None):
         title = env.titles[docname].astext()
@@ -116,6 +139,8 @@ class ChapterInfo:
 
     """
 
+    __slots__ = ("title", "number", "key", "index", "parent", "children", "_directory")
+
     def __init__(
         self,
         title: str,
@@ -132,9 +157,14 @@ class ChapterInfo:
         self.parent = parent
         self.children = list(children) if children is not None else []
 
+        # e.g., "01-erm/02-least_squares"
+        self._directory = "/".join(key.split("/")[:2])
+
     def is_active(self, docname: str) -> bool:
         """Is the page being rendered under this chapter of the book?"""
-        return docname.split("/")[:2] == self.key.split("/")[:2]
+        return docname == self._directory or docname.startswith(
+            self._directory + "/"
+        )
 
     @classmethod
     def from_app_env(
@@ -179,6 +209,8 @@ class PartInfo:
         The chapters in the part. If there are no chapters, this list is empty.
     """
 
+    __slots__ = ("supertitle", "title", "key", "index", "children", "_directory")
+
     def __init__(
         self,
         supertitle: str,
@@ -193,9 +225,14 @@ class PartInfo:
         self.index = index
         self.children = list(children) if children is not None else []
 
+        # e.g., "01-erm"
+        self._directory = key.split("/")[0]
+
     def is_active(self, docname: str) -> bool:
         """Is the page being rendered under this part of the book?"""
-        return docname.split("/")[0] == self.key.split("/")[0]
+        return docname == self._directory or docname.startswith(
+            self._directory + "/"
+        )
 
     @classmethod
     def from_app_env(cls, env, index_docname: str) -> "PartInfo":
@@ -231,7 +268,73 @@ class PartInfo:
         return part
 
 
-def _make_booktree(app) -> List[PartInfo]:
+class BookTree:
+    """The structure of the book: its parts and the supplement pages.
+
+    Iterating over the tree yields its parts, in order. The tree links each page to
+    the next and previous pages, and indexes the pages by their keys so that any
+    page can be found in constant time.
+
+    Attributes
+    ----------
+    parts : List[PartInfo]
+        The parts of the book, in order.
+    supplements : List[PageInfo]
+        The supplement pages at the root of the book.
+    pages : Dict[str, PageInfo]
+        The index, part index, chapter index and section pages, by key. Supplement
+        pages are not included.
+
+    """
+
+    __slots__ = ("parts", "supplements", "pages")
+
+    def __init__(self, parts: Sequence[PartInfo], supplements: Sequence[PageInfo]):
+        self.parts = list(parts)
+        self.supplements = list(supplements)
+        self.pages = {}
+        self._link()
+
+    def _link(self):
+        """Sets the next and prev pointers of each page and indexes the pages."""
+        prev = None
+        for part in self.parts:
+            self.pages.setdefault(part.index.key, part.index)
+            prev = part.index
+            for chapter in part.children:
+                self.pages.setdefault(chapter.index.key, chapter.index)
+                chapter.index.prev = prev
+                prev.next = chapter.index
+                prev = chapter.index
+                for page in chapter.children:
+                    self.pages.setdefault(page.key, page)
+                    page.prev = prev
+                    if prev is not None:
+                        prev.next = page
+                    prev = page
+
+    def page(self, docname: str) -> Optional[PageInfo]:
+        """The page with the given key, or None if it is not in the tree."""
+        return self.pages.get(docname)
+
+    def __iter__(self) -> Iterator[PartInfo]:
+        return iter(self.parts)
+
+    def __len__(self) -> int:
+        return len(self.parts)
+
+    def __getstate__(self):
+        # the pages are pickled without their next and prev pointers; see PageInfo
+        return {"parts": self.parts, "supplements": self.supplements}
+
+    def __setstate__(self, state):
+        self.parts = state["parts"]
+        self.supplements = state["supplements"]
+        self.pages = {}
+        self._link()
+
+
+def _make_booktree(app) -> "BookTree":
     """
     The filesystem structure of the book is as follows:
 
@@ -260,75 +363,143 @@ def _make_booktree(app) -> List[PartInfo]:
         if docname.endswith("/index")
     ]
 
-    # now we walk the tree and set the next and prev pointers for each page
-    prev = None
-    for part in parts:
-        prev = part.index
-        for chapter in part.children:
-            chapter.index.prev = prev
-            prev.next = chapter.index
-            prev = chapter.index
-            for page in chapter.children:
-                page.prev = prev
-                if prev is not None:
-                    prev.next = page
-                prev = page
+    return BookTree(parts, _make_supplements(app))
 
-    return parts
 
+def _make_supplements(app) -> List[PageInfo]:
+    """Information about the supplement pages at the root of the book."""
+    return [
+        PageInfo.from_app_env(app.env, docname, parent=None)
+        for docname in app.env.toctree_includes["index"]
+        if not docname.endswith("/index")
+    ]
 
-def key_to_html_id(key: str) -> str:
-    """Converts a filesystem path to an HTML id."""
-    return key.replace("/", "-")
 
+def _booktree_signature(env) -> tuple:
+    """Summarizes everything the book tree is built from.
+
+    This is the structure of the toctrees reachable from the root index page, the
+    titles of the pages in them, and the metadata of the part index pages. The tree
+    must be rebuilt exactly when this changes.
 
-def _get_active_page(booktree, docname):
-    for part in booktree:
-        if part.index.is_active(docname):
-            return part.index
+    """
+    signature = []
+    seen = set()
+    stack = ["index"]
+    while stack:
+        docname = stack.pop()
+        if docname in seen:
+            continue
+        seen.add(docname)
+        includes = tuple(env.toctree_includes.get(docname, []))
+        title = env.titles[docname].astext() if docname in env.titles else None
+        supertitle = env.metadata.get(docname, {}).get("supertitle")
+        signature.append((docname, includes, title, supertitle))
+        stack.extend(includes)
+    return tuple(sorted(signature))
+
+
+@timed("ml4p.update_booktree")
+def update_booktree(app, env):
+    """Builds the book tree once the environment is up to date.
+
+    Connected to the `env-updated` event. The tree is stored on the environment
+    along with its signature (see :func:`_booktree_signature`), and is rebuilt only
+    when the signature changes. Page renders, including those in parallel writer
+    processes, share the stored tree and must not modify it.
+
+    """
+    signature = _booktree_signature(env)
+    previous = getattr(env, "ml4p_booktree_signature", None)
+    env.ml4p_booktree_changed = previous is not None and previous != signature
+    if previous == signature:
+        return
 
-        for chapter in part.children:
-            if chapter.index.is_active(docname):
-                return chapter.index
+    env.ml4p_booktree = _make_booktree(app)
+    env.ml4p_booktree_signature = signature
 
-            for page in chapter.children:
-                if page.is_active(docname):
-                    return page
 
-    return None
+def get_pages_outdated_by_booktree(app, env) -> List[str]:
+    """Lists the pages to rewrite because the book tree changed.
 
+    Connected to the `env-get-updated` event. Every page's navigation is rendered
+    from the book tree, so when a page's title changes, for instance, every page
+    must be rewritten, not just the one that changed.
 
-def _get_headings(doctree):
+    """
+    if getattr(env, "ml4p_booktree_changed", False):
+        return sorted(env.found_docs)
+    return []
+
+
+def key_to_html_id(key: str) -> str:
+    """Converts a filesystem path to an HTML id."""
+    return key.replace("/", "-")
+
+
+def _get_headings(doctree) -> List[Tuple[str, str, int, int]]:
+    """Lists the (heading, html id, level, previous level) of each section.
+
+    The sections are visited in document order in a single pass that tracks the
+    depth of the current section, so the cost is linear in the size of the doctree.
+
+    """
     headings = []
     prev_level = 1
-    for node in doctree.traverse(section):
-        level = 1
-        parent = node.parent
-        while parent:
-            if isinstance(parent, section):
-                level += 1
-            parent = parent.parent
-        heading = node[0].astext()
-        html_id = node.get("ids", [])[0]
-        headings.append((heading, html_id, level, prev_level))
-        prev_level = level
+    # the nodes still to visit, each with the number of sections containing it
+    stack = [(doctree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if isinstance(node, section):
+            level = depth + 1
+            heading = node[0].astext()
+            html_id = node.get("ids", [])[0]
+            headings.append((heading, html_id, level, prev_level))
+            prev_level = level
+            depth = level
+        stack.extend((child, depth) for child in reversed(node.children))
 
     return headings
 
 
+@timed_reader("ml4p.collect_headings")
+def collect_headings(app, doctree):
+    """Records the headings of the document that was just read.
+
+    Connected to the `doctree-read` event, so that the headings are extracted once
+    per read rather than every time the page is written.
+
+    """
+    env = app.env
+    if not hasattr(env, "ml4p_headings"):
+        env.ml4p_headings = {}
+    env.ml4p_headings[env.docname] = _get_headings(doctree)
+
+
+def purge_headings(app, env, docname):
+    if hasattr(env, "ml4p_headings"):
+        env.ml4p_headings.pop(docname, None)
+
+
+def merge_headings(app, env, docnames, other):
+    """Merges the headings recorded by a parallel reader into the main environment."""
+    if not hasattr(env, "ml4p_headings"):
+        env.ml4p_headings = {}
+    for docname, headings in getattr(other, "ml4p_headings", {}).items():
+        if docname in docnames:
+            env.ml4p_headings[docname] = headings
+
+
+@timed_page_handler("ml4p.make_context")
 def make_context(app, pagename, templatename, context, doctree):
-    if not hasattr(app.env, "cache"):
-        app.env.cache = {}
+    if not hasattr(app.env, "ml4p_booktree"):
+        update_booktree(app, app.env)
 
-    booktree = _make_booktree(app)
+    booktree = app.env.ml4p_booktree
     context["booktree"] = booktree
     context["key_to_html_id"] = key_to_html_id
-    context["active_page"] = _get_active_page(booktree, pagename)
+    context["active_page"] = booktree.page(pagename)
     if doctree is not None:
-        context["headings"] = _get_headings(doctree)
+        context["headings"] = app.env.ml4p_headings.get(pagename, [])
 
-    context["supplements"] = [
-        PageInfo.from_app_env(app.env, docname, parent=None)
-        for docname in app.env.toctree_includes["index"]
-        if not docname.endswith("/index")
-    ]
+    context["supplements"] = booktree.supplements
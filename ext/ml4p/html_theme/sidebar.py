@@ -0,0 +1,139 @@
+"""Renders the book's navigation sidebar once per build."""
+import re
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from sphinx.util.osutil import relative_uri
+
+from ..profiling import timed, timed_page_handler
+from .context import key_to_html_id
+
+# stands in for the relative URL of the root of the book, e.g., "../../", in links
+_ROOT = "\x00ml4p-root\x00"
+
+# marks the place of an attribute that depends on whether a node is active
+_SLOT_PATTERN = re.compile("\x00ml4p-slot-(\\d+)\x00")
+
+# the sidebars rendered for the current build, by id prefix. Set at env-updated and
+# read by every page render; parallel writers inherit them when they are forked
+_sidebars: Dict[str, "Sidebar"] = {}
+
+
+class Sidebar:
+    """The sidebar, rendered once, which can be specialized to any page.
+
+    The sidebar is rendered with every part, chapter and page inactive. Alongside
+    it, we keep a list of patches for each node: the position and length of each
+    attribute that differs when the node is active, along with its active value.
+    Specializing the sidebar to a page applies the patches for the page's part,
+    chapter and the page itself, and fills in the URL of the root of the book.
+
+    """
+
+    __slots__ = ("html", "patches")
+
+    def __init__(self, html: str, patches: Dict[Tuple[str, str], List[tuple]]):
+        self.html = html
+        self.patches = patches
+
+    @classmethod
+    def render(cls, app, booktree, id_prefix: str) -> "Sidebar":
+        """Renders the sidebar.html template for the given book tree."""
+        slots = []
+
+        def active(kind: str, key: str, if_active: str, if_inactive: str) -> str:
+            # parts and chapters are identified by their directories, e.g.,
+            # "01-erm" for the part whose index page is "01-erm/index"
+            if kind == "part":
+                key = key.split("/")[0]
+            elif kind == "chapter":
+                key = "/".join(key.split("/")[:2])
+            slots.append(((kind, key), if_active, if_inactive))
+            return f"\x00ml4p-slot-{len(slots) - 1}\x00"
+
+        def pathto(key: str) -> str:
+            # as with Sphinx's pathto, a page's links to itself are "#"
+            return active("page", key, "#", _ROOT + app.builder.get_target_uri(key))
+
+        rendered = app.builder.templates.render(
+            "sidebar.html",
+            {
+                "id_prefix": id_prefix,
+                "booktree": booktree,
+                "supplements": booktree.supplements,
+                "key_to_html_id": key_to_html_id,
+                "active": active,
+                "pathto": pathto,
+            },
+        )
+
+        # replace each slot with its inactive value, remembering where it went
+        pieces = _SLOT_PATTERN.split(rendered.strip())
+        html = []
+        patches = defaultdict(list)
+        offset = 0
+        for i, piece in enumerate(pieces):
+            if i % 2 == 1:
+                node, if_active, piece = slots[int(piece)]
+                patches[node].append((offset, len(piece), if_active))
+            html.append(piece)
+            offset += len(piece)
+
+        return cls("".join(html), dict(patches))
+
+    def for_page(self, app, pagename: str) -> str:
+        """The sidebar as seen from the given page."""
+        # a part or chapter is active when the page is inside its directory; see
+        # PartInfo.is_active and ChapterInfo.is_active
+        components = pagename.split("/")
+        active_nodes = [
+            ("part", components[0]),
+            ("chapter", "/".join(components[:2])),
+            ("page", pagename),
+        ]
+
+        edits = sorted(
+            edit for node in active_nodes for edit in self.patches.get(node, [])
+        )
+
+        pieces = []
+        last = 0
+        for offset, length, replacement in edits:
+            pieces.append(self.html[last:offset])
+            pieces.append(replacement)
+            last = offset + length
+        pieces.append(self.html[last:])
+
+        root = relative_uri(app.builder.get_target_uri(pagename), "x")[:-1]
+        return "".join(pieces).replace(_ROOT, root)
+
+
+@timed("ml4p.render_sidebars")
+def render_sidebars(app, env):
+    """Renders the mobile and desktop sidebars for this build.
+
+    Connected to the `env-updated` event, after the book tree has been updated.
+
+    """
+    _sidebars.clear()
+    if app.builder.format != "html" or not hasattr(env, "ml4p_booktree"):
+        return
+
+    for id_prefix in ["mobile", "desktop"]:
+        _sidebars[id_prefix] = Sidebar.render(app, env.ml4p_booktree, id_prefix)
+
+
+@timed_page_handler("ml4p.add_sidebar_to_context")
+def add_sidebar_to_context(app, pagename, templatename, context, doctree):
+    """Provides `ml4p_sidebar(id_prefix)` to the templates; see layout.html.
+
+    Connected to the `html-page-context` event.
+
+    """
+
+    def ml4p_sidebar(id_prefix: str) -> str:
+        if id_prefix not in _sidebars:
+            render_sidebars(app, app.env)
+        return _sidebars[id_prefix].for_page(app, pagename)
+
+    context["ml4p_sidebar"] = ml4p_sidebar
@@ -162,14 +162,33 @@ function setupFoldIcons() {
 // ================
 
 function updateGeneratedImageColor(image, theme) {
-  // the end of the src will be either -light.png or -dark.png, and we adjust
-  // it based on the current theme
-  let newSrc = image.src.replace(/-(light|dark)\.png$/, `-${theme}.png`);
-  // this prevents an infinite loop where setting the src triggers the
-  // onload event, which triggers the src to be set again
-  if (newSrc !== image.src) {
-    image.src = newSrc;
+  // the filenames of the images end with either -light.<ext> or -dark.<ext>, and
+  // we adjust them based on the current theme. If the image is in a <picture>,
+  // the srcsets of its <source> elements are adjusted, too
+  let pattern = /-(light|dark)\.(png|webp|avif)\b/g;
+  let replacement = `-${theme}.$2`;
+
+  let elements = [];
+  if (image.parentElement && image.parentElement.tagName === "PICTURE") {
+    elements.push(...image.parentElement.querySelectorAll("source"));
   }
+  elements.push(image);
+
+  elements.forEach(function (element) {
+    ["srcset", "src"].forEach(function (attribute) {
+      let value = element.getAttribute(attribute);
+      if (value === null) {
+        return;
+      }
+
+      // this prevents an infinite loop where setting the src triggers the
+      // onload event, which triggers the src to be set again
+      let newValue = value.replace(pattern, replacement);
+      if (newValue !== value) {
+        element.setAttribute(attribute, newValue);
+      }
+    });
+  });
 }
 
 function installGeneratedImageColorChangers(images) {
@@ -182,9 +201,12 @@ function installGeneratedImageColorChangers(images) {
 }
 
 function initializeGeneratedImage(image) {
-  // set its size
-  image.style.width = (image.naturalWidth / 2).toString() + "px";
-  image.style.height = (image.naturalHeight / 2).toString() + "px";
+  // set its size, unless it was given one; images without a size were rendered
+  // at a pixel ratio of 2
+  if (!image.hasAttribute("width")) {
+    image.style.width = (image.naturalWidth / 2).toString() + "px";
+    image.style.height = (image.naturalHeight / 2).toString() + "px";
+  }
 
   let theme = getTheme();
   updateGeneratedImageColor(image, theme);
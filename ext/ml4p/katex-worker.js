@@ -0,0 +1,25 @@
+// Renders batches of TeX to HTML with KaTeX for the ml4p extension; see katex.py.
+//
+// Usage: node katex-worker.js <path to katex.min.js> <KaTeX options as JSON>
+//
+// Each line read from stdin is a JSON array of [tex, displayMode] pairs. For each
+// line, a JSON array of the rendered HTML, in the same order, is written to stdout.
+
+const readline = require("readline");
+
+const katex = require(process.argv[2]);
+const options = JSON.parse(process.argv[3] || "{}");
+
+const lines = readline.createInterface({ input: process.stdin });
+
+lines.on("line", function (line) {
+  const rendered = JSON.parse(line).map(function ([tex, displayMode]) {
+    // errors are rendered in place, in red, rather than thrown
+    return katex.renderToString(tex, {
+      ...options,
+      displayMode: displayMode,
+      throwOnError: false,
+    });
+  });
+  process.stdout.write(JSON.stringify(rendered) + "\n");
+});
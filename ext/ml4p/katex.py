@@ -0,0 +1,330 @@
+"""Prerenders the book's math to HTML with KaTeX at build time.
+
+When `ml4p_katex_prerender` is set, every math expression in the book is rendered
+once, before the HTML is written, by a Node process running KaTeX. The expressions
+are sent to it in batches, and the results are cached by a hash of the expression
+so that later builds only render expressions they have not seen before. Pages then
+ship typeset math and do not load KaTeX's JavaScript unless their figures need it.
+
+"""
+import collections
+import hashlib
+import json
+import pathlib
+import re
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from docutils import nodes
+from sphinx.errors import ConfigError
+from sphinx.util import logging
+from sphinx.util.math import get_node_equation_number
+
+import genfig.profiling
+import genfig.vendor
+
+from .profiling import timed
+
+logger = logging.getLogger(__name__)
+
+# the script run by the Node process
+WORKER_SCRIPT = pathlib.Path(__file__).parent / "katex-worker.js"
+
+# the number of lines of the worker's stderr kept for the error raised if it stops
+STDERR_TAIL_LINES = 50
+
+# the KaTeX whose stylesheet the pages load; see extrahead.html. Math must be
+# rendered with the same version, since the markup changes between versions
+_KATEX_ASSET = next(
+    asset
+    for asset in genfig.vendor.VENDORED_ASSETS
+    if asset.path.endswith("/katex.min.js")
+)
+KATEX_VERSION = re.match(r"katex@([^/]+)/", _KATEX_ASSET.path).group(1)
+
+# the KaTeX used if `ml4p_katex_path` is not set and the vendored copy is available;
+# see `genfig vendor`
+VENDORED_KATEX = (
+    pathlib.Path(__file__).parents[2]
+    / "vis/js"
+    / genfig.vendor.VENDOR_DIRECTORY
+    / _KATEX_ASSET.path
+)
+
+# matches the version KaTeX's bundle declares, e.g., `version:"0.16.10"`
+_VERSION_PATTERN = re.compile(r"""\bversion:\s*["']([0-9][^"']*)["']""")
+
+# the cache of rendered expressions, kept with the doctrees
+CACHE_FILENAME = "ml4p-katex.json"
+
+# the number of expressions sent to the worker at once
+BATCH_SIZE = 500
+
+# the rendered HTML of every expression in the book, by (tex, display mode). Set at
+# env-updated and read by every page render; parallel writers inherit it when they
+# are forked
+_rendered: Dict[Tuple[str, bool], str] = {}
+
+
+class KaTeXWorker:
+    """A Node process that renders TeX to HTML with KaTeX.
+
+    Starting Node and loading KaTeX takes far longer than rendering an expression,
+    so a single process renders every expression in the build.
+
+    The worker's stderr, where KaTeX writes its warnings, is read continuously by
+    a thread so that the pipe never fills and blocks the worker. Only its last
+    lines are kept, for the error raised if the worker stops.
+
+    Parameters
+    ----------
+    katex_path : pathlib.Path
+        The path to katex.min.js.
+    options : dict
+        KaTeX's rendering options, such as `macros`.
+
+    """
+
+    def __init__(self, katex_path: pathlib.Path, options: dict):
+        self._process = subprocess.Popen(
+            ["node", str(WORKER_SCRIPT), str(katex_path), json.dumps(options)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+        self._stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr_tail.append(line)
+
+    def render(self, expressions: List[Tuple[str, bool]]) -> List[str]:
+        """Renders the (tex, display mode) pairs, returning their HTML in order."""
+        self._process.stdin.write(json.dumps(expressions) + "\n")
+        self._process.stdin.flush()
+        line = self._process.stdout.readline()
+        if not line:
+            self._process.wait()
+            self._stderr_thread.join()
+            raise RuntimeError(
+                "The KaTeX worker stopped unexpectedly:\n"
+                + "".join(self._stderr_tail)
+            )
+        return json.loads(line)
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+        self._stderr_thread.join()
+
+
+def _expression_key(tex: str, display: bool, salt: str) -> str:
+    digest = hashlib.md5(salt.encode())
+    digest.update(json.dumps([tex, display]).encode())
+    return digest.hexdigest()
+
+
+def _read_katex_version(katex_path: pathlib.Path) -> Optional[str]:
+    match = _VERSION_PATTERN.search(katex_path.read_text(encoding="utf-8"))
+    return match.group(1) if match is not None else None
+
+
+def _get_katex_path(config) -> pathlib.Path:
+    """The configured KaTeX, the vendored one, or that of sphinxcontrib.katex.
+
+    Raises
+    ------
+    ConfigError
+        If the KaTeX is not the version whose stylesheet the pages load.
+
+    """
+    if config.ml4p_katex_path is not None:
+        katex_path = pathlib.Path(config.ml4p_katex_path)
+    elif VENDORED_KATEX.exists():
+        katex_path = VENDORED_KATEX
+    else:
+        import sphinxcontrib.katex
+
+        katex_path = pathlib.Path(sphinxcontrib.katex.__file__).parent / "katex.min.js"
+
+    version = _read_katex_version(katex_path)
+    if version is None:
+        logger.warning(
+            f"could not read the version of {katex_path}; prerendered math may not "
+            f"match KaTeX {KATEX_VERSION}'s stylesheet"
+        )
+    elif version != KATEX_VERSION:
+        raise ConfigError(
+            f"Cannot prerender math with KaTeX {version} ({katex_path}): the pages "
+            f"load the stylesheet of KaTeX {KATEX_VERSION}. Run `genfig vendor` to "
+            f"vendor KaTeX {KATEX_VERSION}, or set `ml4p_katex_path` to a copy of it."
+        )
+    return katex_path
+
+
+def _get_expressions(doctree) -> List[Tuple[str, bool]]:
+    return [(node.astext(), False) for node in doctree.traverse(nodes.math)] + [
+        (node.astext(), True) for node in doctree.traverse(nodes.math_block)
+    ]
+
+
+def _collect_math(app, doctree):
+    """Records the math expressions in the document that was just read."""
+    env = app.env
+    if not hasattr(env, "ml4p_math"):
+        env.ml4p_math = {}
+
+    expressions = set(_get_expressions(doctree))
+
+    if expressions:
+        env.ml4p_math[env.docname] = expressions
+    else:
+        env.ml4p_math.pop(env.docname, None)
+
+
+def _purge_math(app, env, docname):
+    if hasattr(env, "ml4p_math"):
+        env.ml4p_math.pop(docname, None)
+
+
+def _merge_math(app, env, docnames, other):
+    """Merges the math recorded by a parallel reader into the main environment."""
+    if not hasattr(env, "ml4p_math"):
+        env.ml4p_math = {}
+    for docname, expressions in getattr(other, "ml4p_math", {}).items():
+        if docname in docnames:
+            env.ml4p_math[docname] = expressions
+
+
+@timed("ml4p.katex.render")
+def _render_math(app, env):
+    """Renders every math expression in the book that is not already cached.
+
+    Connected to the `env-updated` event. The cache is rewritten with only the
+    expressions that are still in use.
+
+    """
+    _rendered.clear()
+    if app.builder.format != "html" or not app.config.ml4p_katex_prerender:
+        return
+
+    katex_path = _get_katex_path(app.config)
+
+    # a change to KaTeX or its options changes every key
+    salt = hashlib.md5(katex_path.read_bytes()).hexdigest() + json.dumps(
+        app.config.ml4p_katex_options, sort_keys=True
+    )
+
+    expressions = set()
+    for doc_expressions in getattr(env, "ml4p_math", {}).values():
+        expressions |= doc_expressions
+    keys = {
+        _expression_key(tex, display, salt): (tex, display)
+        for tex, display in expressions
+    }
+
+    cache_path = pathlib.Path(app.doctreedir) / CACHE_FILENAME
+    cache = {}
+    if cache_path.exists():
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    missing = sorted(key for key in keys if key not in cache)
+    genfig.profiling.count("ml4p.katex.cache_hits", len(keys) - len(missing))
+    genfig.profiling.count("ml4p.katex.cache_misses", len(missing))
+    if missing:
+        logger.info(f"rendering {len(missing)} math expressions with KaTeX...")
+        worker = KaTeXWorker(katex_path, app.config.ml4p_katex_options)
+        try:
+            for start in range(0, len(missing), BATCH_SIZE):
+                batch = missing[start : start + BATCH_SIZE]
+                rendered = worker.render([keys[key] for key in batch])
+                cache.update(zip(batch, rendered))
+        finally:
+            worker.close()
+
+    used = {key: cache[key] for key in keys}
+    with open(cache_path, "w") as f:
+        json.dump(used, f)
+
+    _rendered.update((expression, used[key]) for key, expression in keys.items())
+
+
+def _render(tex: str, display: bool) -> str:
+    if (tex, display) not in _rendered:
+        raise RuntimeError(f"The math expression {tex!r} was not prerendered.")
+    return _rendered[(tex, display)]
+
+
+def visit_math(self, node):
+    self.body.append(self.starttag(node, "span", "", CLASS="math"))
+    self.body.append(_render(node.astext(), False))
+    self.body.append("</span>")
+    raise nodes.SkipNode
+
+
+def visit_math_block(self, node):
+    self.body.append(self.starttag(node, "div", CLASS="math"))
+    if node["number"]:
+        number = get_node_equation_number(self, node)
+        self.body.append(f'<span class="eqno">({number})')
+        self.add_permalink_ref(node, "Permalink to this equation")
+        self.body.append("</span>")
+    self.body.append(_render(node.astext(), True))
+    self.body.append("</div>\n")
+    raise nodes.SkipNode
+
+
+def _use_prerenderer(app, config):
+    """Makes the prerenderer Sphinx's math renderer, if prerendering is enabled.
+
+    The renderer is only registered when it is used, since Sphinx cannot choose
+    between several. sphinxcontrib.katex is told that math is prerendered, too, so
+    that it does not add KaTeX's JavaScript to every page.
+
+    """
+    if not config.ml4p_katex_prerender:
+        return
+
+    # checks the version of KaTeX before any documents are read
+    _get_katex_path(config)
+
+    app.add_html_math_renderer(
+        "ml4p",
+        inline_renderers=(visit_math, None),
+        block_renderers=(visit_math_block, None),
+    )
+    config.html_math_renderer = "ml4p"
+    config.katex_prerender = True
+
+
+def _add_math_to_context(app, pagename, templatename, context, doctree):
+    """Tells the templates whether the page's math is prerendered.
+
+    Connected to the `html-page-context` event.
+
+    """
+    context["ml4p_math_prerendered"] = app.config.ml4p_katex_prerender
+
+
+def setup(app):
+    # whether to render math at build time. If so, math is rendered by KaTeX in
+    # Node, which must be installed, rather than in the browser
+    app.add_config_value("ml4p_katex_prerender", False, "html")
+
+    # the path to katex.min.js, and KaTeX's options (e.g., {"macros": {...}}). By
+    # default, the vendored KaTeX is used if it exists. Either way, it must be the
+    # version whose stylesheet the pages load
+    app.add_config_value("ml4p_katex_path", None, "html")
+    app.add_config_value("ml4p_katex_options", {}, "html")
+
+    app.connect("config-inited", _use_prerenderer)
+    app.connect("doctree-read", _collect_math)
+    app.connect("env-purge-doc", _purge_math)
+    app.connect("env-merge-info", _merge_math)
+    app.connect("env-updated", _render_math)
+    app.connect("html-page-context", _add_math_to_context)
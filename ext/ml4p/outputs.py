@@ -0,0 +1,144 @@
+"""Reports which output files a build actually changed."""
+import hashlib
+import json
+import os
+import pathlib
+from typing import Dict, List
+
+from sphinx.util import logging
+
+from .profiling import timed
+
+logger = logging.getLogger(__name__)
+
+# the manifest of the previous build's outputs. It is kept with the doctrees rather
+# than in the output directory so that it is not deployed along with the book
+MANIFEST_FILENAME = "ml4p-outputs.json"
+
+# the number of changed files that are listed individually at the default verbosity
+MAX_LISTED = 20
+
+# the output files changed or added by the last build; see `last_changed_outputs`
+_last_changed: List[str] = []
+
+
+def _hash_file(path: pathlib.Path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _scan_outputs(
+    outdir: pathlib.Path, doctreedir: pathlib.Path, previous: Dict[str, dict]
+) -> Dict[str, dict]:
+    """Finds every output file along with its size, mtime and hash.
+
+    Files whose size and mtime match the previous manifest are not re-hashed, so
+    only the files that the build rewrote are read. The doctrees are skipped if
+    they are kept within the output directory.
+
+    """
+    manifest = {}
+    for directory, subdirectories, filenames in os.walk(outdir):
+        subdirectories[:] = [
+            d for d in subdirectories if pathlib.Path(directory, d) != doctreedir
+        ]
+        for filename in filenames:
+            path = pathlib.Path(directory) / filename
+            key = path.relative_to(outdir).as_posix()
+            stat = path.stat()
+            entry = previous.get(key)
+            if (
+                entry is None
+                or entry["size"] != stat.st_size
+                or entry["mtime"] != stat.st_mtime_ns
+            ):
+                entry = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "md5": _hash_file(path),
+                }
+            manifest[key] = entry
+    return manifest
+
+
+@timed("ml4p.report_changed_outputs")
+def report_changed_outputs(app, exception):
+    """Compares the output files with those of the previous build and logs the diff.
+
+    Connected to the `build-finished` event. A file counts as changed only if its
+    contents differ, so pages that were rewritten with identical HTML are not
+    reported. The first few files of each kind are listed; the rest are listed at
+    verbose level.
+
+    """
+    _last_changed.clear()
+    if exception is not None or not app.config.ml4p_report_changed_outputs:
+        return
+
+    outdir = pathlib.Path(app.outdir).resolve()
+    doctreedir = pathlib.Path(app.doctreedir).resolve()
+    manifest_path = doctreedir / MANIFEST_FILENAME
+
+    previous = {}
+    if manifest_path.exists():
+        try:
+            with open(manifest_path) as f:
+                previous = json.load(f)
+        except ValueError:
+            # e.g., the build writing it was interrupted; treat this as a first build
+            pass
+
+    current = _scan_outputs(outdir, doctreedir, previous)
+
+    added = sorted(set(current) - set(previous))
+    removed = sorted(set(previous) - set(current))
+    changed = sorted(
+        key
+        for key in set(current) & set(previous)
+        if current[key]["md5"] != previous[key]["md5"]
+    )
+
+    # written to a temporary file first so that an interrupted build cannot leave a
+    # partial manifest behind
+    temporary_path = manifest_path.with_suffix(".tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(current, f)
+    os.replace(temporary_path, manifest_path)
+
+    _last_changed[:] = sorted(changed + added)
+
+    if not previous:
+        logger.info(f"recorded {len(current)} output files for change reports")
+        return
+
+    logger.info(
+        f"output files: {len(changed)} changed, {len(added)} added, "
+        f"{len(removed)} removed, {len(current) - len(changed) - len(added)} "
+        "unchanged"
+    )
+    for label, keys in [("changed", changed), ("added", added), ("removed", removed)]:
+        for i, key in enumerate(keys):
+            if i < MAX_LISTED:
+                logger.info(f"  {label}: {key}")
+            else:
+                logger.verbose(f"  {label}: {key}")
+
+
+def last_changed_outputs() -> List[str]:
+    """The output files that the last build changed or added.
+
+    Paths are relative to the output directory. The development server uses them to
+    decide which pages to reload; see ml4p.serve.
+
+    """
+    return list(_last_changed)
+
+
+def setup(app):
+    # whether to report, at the end of each build, which output files changed
+    app.add_config_value("ml4p_report_changed_outputs", True, "")
+
+    app.connect("build-finished", report_changed_outputs)
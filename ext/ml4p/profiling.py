@@ -0,0 +1,159 @@
+"""Reports where the time of a build goes, if `ml4p_profile` is set.
+
+The extension's event handlers and visitors, and genfig's figure rendering, are
+timed with genfig.profiling. So are the reading and writing of each document by
+Sphinx, so that a slow page can be told apart from a slow handler. At the end of
+the build the timings, per phase and per document, and genfig's cache counts are
+written as JSON, and the slowest phases and documents are logged.
+
+Profiling is off by default and costs nothing when off. Documents read or written
+by parallel workers are not timed, so profile with ``-j 1``.
+
+"""
+import json
+import pathlib
+import time
+from typing import Callable
+
+import genfig.profiling
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+# the report is written here, relative to the doctree directory, unless
+# `ml4p_profile_report` is set. Like the output manifest, it is kept out of the
+# output directory so that it is not deployed along with the book
+REPORT_FILENAME = "ml4p-profile.json"
+
+# the time the profiled build started, as given by time.perf_counter()
+_build_start = None
+
+
+def timed(name: str) -> Callable:
+    """Times each call of a handler that concerns the whole build."""
+    return genfig.profiling.timed(name)
+
+
+def timed_page_handler(name: str) -> Callable:
+    """Times each call of an `html-page-context` handler, by page."""
+    return genfig.profiling.timed(name, document=lambda app, pagename, *args: pagename)
+
+
+def timed_reader(name: str) -> Callable:
+    """Times each call of a `doctree-read` handler, by document."""
+    return genfig.profiling.timed(name, document=lambda app, doctree: app.env.docname)
+
+
+def timed_visitor(name: str) -> Callable:
+    """Times each call of a node visitor, by the document being written."""
+    return genfig.profiling.timed(
+        name, document=lambda self, node: self.builder.current_docname
+    )
+
+
+def _time_documents(builder):
+    """Times the builder's reading and writing of each document."""
+    read_doc = builder.read_doc
+    write_doc = builder.write_doc
+
+    def timed_read_doc(docname, *args, **kwargs):
+        with genfig.profiling.phase("sphinx.read", docname):
+            return read_doc(docname, *args, **kwargs)
+
+    def timed_write_doc(docname, *args, **kwargs):
+        with genfig.profiling.phase("sphinx.write", docname):
+            return write_doc(docname, *args, **kwargs)
+
+    builder.read_doc = timed_read_doc
+    builder.write_doc = timed_write_doc
+
+
+def start_profiling(app):
+    """Starts recording timings, if profiling is enabled.
+
+    Connected to the `builder-inited` event, so that loading the environment and
+    reading the documents are included.
+
+    """
+    global _build_start
+    if not app.config.ml4p_profile:
+        return
+
+    if app.parallel > 1:
+        logger.warning(
+            "documents read or written in parallel are not profiled; "
+            "build with -j 1 for complete timings"
+        )
+
+    genfig.profiling.reset()
+    genfig.profiling.enable()
+    _time_documents(app.builder)
+    _build_start = time.perf_counter()
+
+
+def _document_seconds(timings: dict) -> float:
+    return timings.get("sphinx.read", 0) + timings.get("sphinx.write", 0)
+
+
+def write_profile(app, exception):
+    """Writes the timings as JSON and logs the slowest phases and documents.
+
+    Connected to the `build-finished` event, after the extension's other handlers,
+    so that they are timed too.
+
+    """
+    if not genfig.profiling.is_enabled():
+        return
+    genfig.profiling.disable()
+
+    report = {
+        "total": time.perf_counter() - _build_start,
+        **genfig.profiling.report(),
+    }
+
+    if app.config.ml4p_profile_report is not None:
+        path = pathlib.Path(app.config.ml4p_profile_report)
+    else:
+        path = pathlib.Path(app.doctreedir) / REPORT_FILENAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    top = app.config.ml4p_profile_top
+    logger.info(
+        f"profiled the build ({report['total']:.2f}s); report written to {path}"
+    )
+
+    logger.info("slowest phases (phases may nest, so their times overlap):")
+    phases = sorted(report["phases"].items(), key=lambda item: -item[1]["total"])
+    for name, timings in phases[:top]:
+        logger.info(
+            f"  {timings['total']:8.3f}s  {name} "
+            f"({timings['calls']} calls, max {timings['max']:.3f}s)"
+        )
+
+    documents = sorted(
+        report["documents"].items(), key=lambda item: -_document_seconds(item[1])
+    )
+    if documents:
+        logger.info("slowest documents (reading and writing):")
+        for docname, timings in documents[:top]:
+            logger.info(f"  {_document_seconds(timings):8.3f}s  {docname}")
+
+    if report["counters"]:
+        logger.info(
+            "counts: "
+            + ", ".join(f"{name} {n}" for name, n in report["counters"].items())
+        )
+
+
+def setup(app):
+    # whether to time the build. The report is written to `ml4p_profile_report`, by
+    # default ml4p-profile.json in the doctree directory, and the `ml4p_profile_top`
+    # slowest phases and documents are logged
+    app.add_config_value("ml4p_profile", False, "")
+    app.add_config_value("ml4p_profile_report", None, "")
+    app.add_config_value("ml4p_profile_top", 10, "")
+
+    app.connect("builder-inited", start_profiling)
+    app.connect("build-finished", write_profile, priority=900)
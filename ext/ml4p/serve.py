@@ -0,0 +1,335 @@
+"""A development server that rebuilds the book as its sources change.
+
+Run from the root of the repository with::
+
+    python -m ml4p.serve
+
+The server keeps Sphinx, the extensions and the environment's pickle warm in one
+process, so a rebuild only reads and writes the documents that are out of date. It
+serves the HTML output with a small script that reloads the pages a rebuild
+changed. It watches:
+
+- the book's sources, and the theme's templates and static files, rebuilding
+  incrementally when they change;
+- the JS and Python figures, re-reading the documents that use a figure when it
+  changes so that their static images are regenerated;
+- the extension's Python code and the book's conf.py, restarting the server when
+  they change, since they cannot be reloaded in place.
+
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import pathlib
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from sphinx.application import Sphinx
+from sphinx.util.docutils import docutils_namespace, patch_docutils
+
+from . import outputs
+
+PROJECT_ROOT = pathlib.Path(__file__).parents[2]
+
+# the directories that are watched, and the directories within them that are not
+WATCHED_DIRECTORIES = ["book", "ext/ml4p", "vis/js", "vis/py"]
+IGNORED_DIRECTORIES = {"_build", "__pycache__", ".git", "node_modules"}
+
+# how often the sources are checked for changes, in seconds
+POLL_INTERVAL = 0.3
+
+# the path of the stream of reload events
+EVENTS_PATH = "/__ml4p__/events"
+
+# injected into every page served. It reloads the page if a rebuild changed it or
+# any of the files it may load, and swaps in the new stylesheets if only they changed
+RELOAD_SCRIPT = """
+<script>
+  new EventSource("%s").onmessage = function (event) {
+    let changed = JSON.parse(event.data);
+    let page = location.pathname.replace(/^\\//, "");
+    if (page === "" || page.endsWith("/")) {
+      page += "index.html";
+    }
+
+    if (changed.length > 0 && changed.every((path) => path.endsWith(".css"))) {
+      for (let link of document.querySelectorAll('link[rel="stylesheet"]')) {
+        let url = new URL(link.href);
+        url.searchParams.set("ml4p-reload", Date.now());
+        link.href = url.toString();
+      }
+    } else if (changed.some((path) => path === page || !path.endsWith(".html"))) {
+      location.reload();
+    }
+  };
+</script>
+""" % EVENTS_PATH
+
+
+def _snapshot() -> Dict[pathlib.Path, int]:
+    """The modification time of every watched file."""
+    mtimes = {}
+    for directory in WATCHED_DIRECTORIES:
+        for root, subdirectories, filenames in os.walk(PROJECT_ROOT / directory):
+            subdirectories[:] = [
+                d for d in subdirectories if d not in IGNORED_DIRECTORIES
+            ]
+            for filename in filenames:
+                path = pathlib.Path(root) / filename
+                try:
+                    mtimes[path] = path.stat().st_mtime_ns
+                except FileNotFoundError:
+                    # deleted while we were walking
+                    pass
+    return mtimes
+
+
+def _requires_restart(path: pathlib.Path) -> bool:
+    relative = path.relative_to(PROJECT_ROOT)
+    return relative == pathlib.Path("book/conf.py") or (
+        relative.parts[:2] == ("ext", "ml4p") and path.suffix == ".py"
+    )
+
+
+class _ReloadBroadcaster:
+    """Sends the output files changed by each rebuild to the connected pages."""
+
+    def __init__(self):
+        self._clients: List[queue.Queue] = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> queue.Queue:
+        client = queue.Queue()
+        with self._lock:
+            self._clients.append(client)
+        return client
+
+    def disconnect(self, client: queue.Queue):
+        with self._lock:
+            self._clients.remove(client)
+
+    def broadcast(self, changed: List[str]):
+        with self._lock:
+            for client in self._clients:
+                client.put(changed)
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    """Serves the output directory, adding the reload script to each page."""
+
+    broadcaster: _ReloadBroadcaster
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == EVENTS_PATH:
+            self._stream_events()
+            return
+
+        path = pathlib.Path(self.translate_path(self.path))
+        if path.is_dir():
+            path = path / "index.html"
+        if path.suffix != ".html" or not path.is_file():
+            super().do_GET()
+            return
+
+        html = path.read_text(encoding="utf-8")
+        html = html.replace("</body>", RELOAD_SCRIPT + "</body>", 1).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(html)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(html)
+
+    def _stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+
+        client = self.broadcaster.connect()
+        try:
+            while True:
+                try:
+                    changed = client.get(timeout=15)
+                    self.wfile.write(f"data: {json.dumps(changed)}\n\n".encode())
+                except queue.Empty:
+                    # keeps the connection alive, and notices when it is closed
+                    self.wfile.write(b": ping\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.broadcaster.disconnect(client)
+
+
+class DevelopmentServer:
+    """Rebuilds the book in a warm process and serves the output.
+
+    Parameters
+    ----------
+    host : str
+        The address to serve on.
+    port : int
+        The port to serve on.
+
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+
+        self.build_directory = PROJECT_ROOT / "_build"
+        self.outdir = self.build_directory / "html"
+        self.app = None
+
+        # documents to re-read on the next rebuild, such as those using a figure
+        # whose sources changed. Sphinx only notices changes to the documents
+        self._stale_documents: Set[str] = set()
+
+        self.broadcaster = _ReloadBroadcaster()
+
+    def _make_app(self) -> Sphinx:
+        """Makes the Sphinx application for a rebuild.
+
+        Some extensions (such as sphinxcontrib.katex) clean up after themselves
+        when a build finishes, so an application cannot be built twice. Making one
+        takes a few milliseconds in a process that has already imported Sphinx and
+        the extensions; the environment is loaded from the pickle of the last
+        build, so only out-of-date documents are read.
+
+        """
+        app = Sphinx(
+            srcdir=str(PROJECT_ROOT / "book"),
+            confdir=str(PROJECT_ROOT / "book"),
+            outdir=str(self.outdir),
+            doctreedir=str(self.build_directory / "doctrees"),
+            buildername="html",
+        )
+        app.connect("env-get-outdated", self._get_stale_documents)
+        return app
+
+    def _get_stale_documents(self, app, env, added, changed, removed) -> List[str]:
+        stale = sorted(self._stale_documents & env.found_docs)
+        self._stale_documents.clear()
+        return stale
+
+    def _static_figure_documents(self) -> Dict[Tuple[str, str], Set[str]]:
+        """The documents using each static figure, by ("js" or "py", figure name).
+
+        Dynamic figures are left out: their pages load their sources, which are
+        copied to the output at the end of every build, so need not be re-read.
+
+        """
+        documents = defaultdict(set)
+        if self.app is None:
+            return documents
+
+        env = self.app.env
+        for kind, record in [("js", "ml4p_static_figures"), ("py", "ml4p_py_figures")]:
+            for docname, keys in getattr(env, record, {}).items():
+                for figure_name, _ in keys:
+                    documents[(kind, figure_name)].add(docname)
+        return documents
+
+    def _mark_stale(self, paths: List[pathlib.Path]):
+        """Marks the documents using static figures whose sources changed as stale."""
+        documents = self._static_figure_documents()
+        for path in paths:
+            parts = path.relative_to(PROJECT_ROOT).parts
+            if parts[:3] == ("vis", "js", "figures") and len(parts) > 4:
+                self._stale_documents |= documents.get(("js", parts[3]), set())
+            elif parts[:2] == ("vis", "py") and len(parts) > 3:
+                self._stale_documents |= documents.get(("py", parts[2]), set())
+            elif parts[:3] == ("vis", "js", "lib"):
+                # shared code may be used by any JS figure
+                for (kind, _), docnames in documents.items():
+                    if kind == "js":
+                        self._stale_documents |= docnames
+
+    def build(self):
+        """Rebuilds the book, then tells the pages what changed."""
+        start = time.perf_counter()
+        try:
+            # as in sphinx-build, docutils' registries are restored after each build
+            # so that the extensions can register their directives again
+            with patch_docutils(PROJECT_ROOT / "book"), docutils_namespace():
+                self.app = self._make_app()
+                self.app.build()
+        except Exception as exc:
+            print(f"ml4p: the build failed: {exc}", file=sys.stderr)
+            return
+
+        changed = outputs.last_changed_outputs()
+        print(
+            f"ml4p: rebuilt in {time.perf_counter() - start:.2f}s; "
+            f"{len(changed)} output file(s) changed"
+        )
+        if changed:
+            self.broadcaster.broadcast(changed)
+
+    def _serve(self):
+        handler = functools.partial(_Handler, directory=str(self.outdir))
+        _Handler.broadcaster = self.broadcaster
+        server = http.server.ThreadingHTTPServer((self.host, self.port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"ml4p: serving the book at http://{self.host}:{self.port}/")
+
+    def run(self):
+        """Builds the book, then serves it and rebuilds it until interrupted."""
+        self.build()
+        self._serve()
+
+        mtimes = _snapshot()
+        while True:
+            time.sleep(POLL_INTERVAL)
+            current = _snapshot()
+            modified = sorted(
+                path
+                for path in current.keys() | mtimes.keys()
+                if current.get(path) != mtimes.get(path)
+            )
+            mtimes = current
+            if not modified:
+                continue
+
+            for path in modified:
+                print(f"ml4p: {path.relative_to(PROJECT_ROOT)} changed")
+
+            if any(_requires_restart(path) for path in modified):
+                print("ml4p: the extension or configuration changed; restarting")
+                os.execv(
+                    sys.executable,
+                    [sys.executable, "-m", "ml4p.serve", *sys.argv[1:]],
+                )
+
+            self._mark_stale(modified)
+            self.build()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m ml4p.serve",
+        description="Serves the book, rebuilding it as its sources change.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    try:
+        DevelopmentServer(args.host, args.port).run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Helpers for the images of static figures, shared by the JS and Python figures."""
+
+import json
+import pathlib
+import warnings
+from typing import Dict, List, Sequence, Tuple
+
+from PIL import Image, features
+
+# the themes that every static figure is rendered in
+THEMES = ("light", "dark")
+
+# the formats that static figures can be saved in, with the options passed to PIL
+IMAGE_FORMATS = {
+    "png": {"format": "PNG", "optimize": True},
+    "webp": {"format": "WEBP", "lossless": True, "method": 6},
+    "avif": {"format": "AVIF", "quality": 90},
+}
+
+
+def supported_formats() -> List[str]:
+    """The image formats that static figures can be saved in with this Pillow.
+
+    Returns
+    -------
+    List[str]
+        A subset of "png", "webp" and "avif". PNG is always supported.
+
+    """
+    with warnings.catch_warnings():
+        # older versions of Pillow warn about features they do not know of
+        warnings.simplefilter("ignore")
+        return [fmt for fmt in IMAGE_FORMATS if fmt == "png" or features.check(fmt)]
+
+
+def validate_image_settings(formats: Sequence[str], pixel_ratios: Sequence[float]):
+    """Checks the formats and pixel ratios that a figure is to be rendered in.
+
+    Raises
+    ------
+    ValueError
+        If a format is not supported, or if a pixel ratio is not positive.
+
+    """
+    unsupported = [fmt for fmt in formats if fmt not in supported_formats()]
+    if unsupported or not formats:
+        raise ValueError(
+            f"Invalid image formats {list(formats)}. Must be a nonempty selection of "
+            f"the formats supported by Pillow: {supported_formats()}."
+        )
+
+    if not pixel_ratios or any(ratio <= 0 for ratio in pixel_ratios):
+        raise ValueError(
+            "The pixel ratios must be a nonempty list of positive numbers."
+        )
+
+
+def static_image_filename(
+    figbasename: str, theme: str, pixel_ratio: float, image_format: str
+) -> str:
+    """The filename of one of the images of a static figure.
+
+    Parameters
+    ----------
+    figbasename : str
+        The basename of the figure, as returned by :func:`generate_static`.
+    theme : str
+        Either "light" or "dark".
+    pixel_ratio : float
+        The device pixel ratio the image was rendered at.
+    image_format : str
+        The format of the image, e.g., "png".
+
+    Returns
+    -------
+    str
+        The filename, e.g., "figure-<hash>-2x-dark.png".
+
+    """
+    return f"{figbasename}-{pixel_ratio:g}x-{theme}.{image_format}"
+
+
+def get_static_size(
+    figure_directory: pathlib.Path, figbasename: str
+) -> Tuple[int, int]:
+    """Reads the size of a generated static figure, in CSS pixels.
+
+    This is the size at which the figure should be displayed; the image at pixel
+    ratio `r` is `r` times as large.
+
+    Parameters
+    ----------
+    figure_directory : pathlib.Path
+        The directory containing the figure.
+    figbasename : str
+        The basename of the figure, as returned by :func:`generate_static`.
+
+    Returns
+    -------
+    Tuple[int, int]
+        The width and height.
+
+    """
+    with open(figure_directory / "_build" / f"{figbasename}.json") as f:
+        size = json.load(f)
+    return size["width"], size["height"]
+
+
+def save_static_images(
+    build_directory: pathlib.Path,
+    figbasename: str,
+    images: Dict[Tuple[float, str], Image.Image],
+    formats: Sequence[str],
+):
+    """Saves the rendered images of a figure along with its display size.
+
+    Parameters
+    ----------
+    build_directory : pathlib.Path
+        The directory to save the images in.
+    figbasename : str
+        The basename of the figure.
+    images : Dict[Tuple[float, str], Image.Image]
+        The image rendered at each (pixel ratio, theme) pair.
+    formats : Sequence[str]
+        The formats to save each image in.
+
+    """
+    for (pixel_ratio, theme), img in images.items():
+        for image_format in formats:
+            filename = static_image_filename(
+                figbasename, theme, pixel_ratio, image_format
+            )
+            img.save(build_directory / filename, **IMAGE_FORMATS[image_format])
+
+    # record the size of the figure in CSS pixels, for use in <img> tags
+    (pixel_ratio, _), img = next(iter(images.items()))
+    size = {
+        "width": round(img.width / pixel_ratio),
+        "height": round(img.height / pixel_ratio),
+    }
+    with open(build_directory / f"{figbasename}.json", "w") as f:
+        json.dump(size, f)
+
+
+def static_images_exist(
+    figure_directory: pathlib.Path,
+    figbasename: str,
+    formats: Sequence[str],
+    pixel_ratios: Sequence[float],
+) -> bool:
+    """Whether every image of the figure has already been generated.
+
+    Basenames are derived from the contents of the figure's sources, so the images
+    are up to date exactly when they exist.
+
+    """
+    build_directory = figure_directory / "_build"
+    filenames = [f"{figbasename}.json"] + [
+        static_image_filename(figbasename, theme, pixel_ratio, image_format)
+        for theme in THEMES
+        for pixel_ratio in pixel_ratios
+        for image_format in formats
+    ]
+    return all((build_directory / filename).exists() for filename in filenames)
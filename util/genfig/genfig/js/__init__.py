@@ -1,2 +1,12 @@
+from .._images import (
+    IMAGE_FORMATS,
+    get_static_size,
+    static_image_filename,
+    supported_formats,
+)
 from ._preview import make_preview
-from ._static import generate_static
+from ._static import CAPTURE_MODES, generate_static, generate_static_many
+from ._browser import DriverPool
+from ._sources import SourceHasher
+from ._server import FigureServer
+from ._usage import find_jsfig_usages, JSFigureUsage
@@ -0,0 +1,133 @@
+"""Provides `DriverPool`, a pool of long-lived headless browsers."""
+
+import contextlib
+import queue
+import threading
+from typing import Optional, Iterator
+
+import selenium.webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
+
+from .. import profiling
+
+
+@profiling.timed("genfig.js.driver_launch")
+def _launch_driver() -> selenium.webdriver.Chrome:
+    options = Options()
+    options.add_argument("--headless")  # Ensure GUI is off
+    options.add_argument("--no-sandbox")
+    return selenium.webdriver.Chrome(options=options)
+
+
+def _is_healthy(driver: selenium.webdriver.Chrome) -> bool:
+    """Checks that the browser behind the driver is still responding."""
+    try:
+        return driver.execute_script("return 1") == 1
+    except WebDriverException:
+        return False
+
+
+def _quit(driver: selenium.webdriver.Chrome):
+    try:
+        driver.quit()
+    except WebDriverException:
+        # the browser has already crashed; there is nothing left to clean up
+        pass
+
+
+class _PooledDriver:
+    def __init__(self, driver: selenium.webdriver.Chrome):
+        self.driver = driver
+        self.renders = 0
+
+
+class DriverPool:
+    """A pool of long-lived headless Chrome drivers.
+
+    Launching Chrome is by far the most expensive part of rendering a static
+    figure, so instead of starting a fresh browser for every screenshot, the pool
+    launches drivers lazily, hands them out with :meth:`driver`, and takes them back
+    when the caller is done. Before a driver is handed out it is checked for
+    liveness; crashed drivers are replaced, and drivers that have performed
+    `max_renders` renders are recycled to bound the memory that long-lived browsers
+    tend to leak.
+
+    The pool can be used as a context manager, in which case it is closed on exit.
+
+    Parameters
+    ----------
+    size : int
+        The maximum number of drivers that are alive at once. Default is 1.
+    max_renders : int, optional
+        The number of renders a driver may perform before it is quit and replaced.
+        Default is 50. If None, drivers are never recycled.
+
+    """
+
+    def __init__(self, size: int = 1, max_renders: Optional[int] = 50):
+        if size < 1:
+            raise ValueError("The pool size must be at least 1.")
+
+        self.size = size
+        self.max_renders = max_renders
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(size)
+        self._closed = False
+
+    def _checkout(self) -> _PooledDriver:
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return _PooledDriver(_launch_driver())
+
+            if _is_healthy(pooled.driver):
+                return pooled
+
+            _quit(pooled.driver)
+
+    def _checkin(self, pooled: _PooledDriver):
+        expired = self.max_renders is not None and pooled.renders >= self.max_renders
+        if self._closed or expired:
+            _quit(pooled.driver)
+        else:
+            self._idle.put(pooled)
+
+    @contextlib.contextmanager
+    def driver(self) -> Iterator[selenium.webdriver.Chrome]:
+        """Borrows a driver from the pool, blocking until one is available.
+
+        If the body of the `with` block raises, the driver is assumed to be in an
+        unknown state and is quit rather than returned to the pool.
+
+        """
+        if self._closed:
+            raise RuntimeError("The driver pool has been closed.")
+
+        with self._slots:
+            pooled = self._checkout()
+            try:
+                yield pooled.driver
+            except BaseException:
+                _quit(pooled.driver)
+                raise
+            pooled.renders += 1
+            self._checkin(pooled)
+
+    def close(self):
+        """Quits every idle driver. Drivers still in use are quit when returned."""
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            _quit(pooled.driver)
+
+    def __enter__(self) -> "DriverPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
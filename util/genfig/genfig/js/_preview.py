@@ -5,6 +5,8 @@ from typing import Optional
 import json
 import pathlib
 
+from .. import vendor
+
 
 def _read_preview_template() -> str:
     """Reads the preview template from the package.
@@ -19,15 +21,37 @@ def _read_preview_template() -> str:
         return f.read()
 
 
+def _use_vendored_assets(preview: str, root: pathlib.Path) -> str:
+    """Points the CDN URLs in the preview at the vendored copies of the assets.
+
+    Only assets that have been vendored (see `genfig vendor`) are replaced. The
+    preview is served from `root`, the /vis/js directory, so the vendored assets are
+    under /lib/vendor.
+
+    """
+    vendor_directory = root / vendor.VENDOR_DIRECTORY
+    for asset in vendor.VENDORED_ASSETS:
+        path = vendor.vendored_path(vendor_directory, asset.url)
+        if path is not None:
+            preview = preview.replace(
+                asset.url, f"/{vendor.VENDOR_DIRECTORY.as_posix()}/{path}"
+            )
+    return preview
+
+
 def _make_build_directory(figure_directory: pathlib.Path) -> pathlib.Path:
     # check for _build directory
     build_directory = figure_directory / "_build"
-    if not build_directory.exists():
-        build_directory.mkdir()
+    build_directory.mkdir(exist_ok=True)
     return build_directory
 
 
-def make_preview(figure_directory: pathlib.Path, dynamic=True, figure_options: Optional[dict] = None):
+def make_preview(
+    figure_directory: pathlib.Path,
+    dynamic=True,
+    figure_options: Optional[dict] = None,
+    filename: Optional[str] = None,
+):
     """Creates an HTML page suitable for (live) previewing the figure.
 
     Parameters
@@ -44,6 +68,10 @@ def make_preview(figure_directory: pathlib.Path, dynamic=True, figure_options: O
         dictionary is used. This is serialized to JSON and embedded in the
         preview HTML.
 
+    filename : str, optional
+        The name of the preview file written to the `_build` directory. Default is
+        None, in which case it is "preview-dynamic.html" or "preview-static.html".
+
     """
     if not (figure_directory / "main.js").exists():
         raise FileNotFoundError(f"main.js not found in {figure_directory}")
@@ -64,7 +92,10 @@ def make_preview(figure_directory: pathlib.Path, dynamic=True, figure_options: O
         }
     )
 
+    preview = _use_vendored_assets(preview, figure_directory.parent.parent)
+
     # write the preview to _build/preview.html
-    filename = "preview-dynamic.html" if dynamic else "preview-static.html"
+    if filename is None:
+        filename = "preview-dynamic.html" if dynamic else "preview-static.html"
     with open(build_directory / filename, "w") as f:
         f.write(preview)
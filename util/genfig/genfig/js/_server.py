@@ -0,0 +1,103 @@
+"""Provides `FigureServer`, an in-process webserver for the JS figures."""
+
+import functools
+import http.server
+import pathlib
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from .. import profiling
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        # the default handler logs every request to stderr
+        pass
+
+
+class FigureServer:
+    """Serves the /vis/js directory over HTTP from a background thread.
+
+    The server binds to a port chosen by the operating system, so several servers
+    (e.g., from concurrent builds on the same machine) never collide. :meth:`start`
+    returns only once the server is answering requests.
+
+    The server can be used as a context manager, in which case it is started on
+    entry and stopped on exit.
+
+    Parameters
+    ----------
+    directory : pathlib.Path
+        The directory to serve. This should be the /vis/js directory, so that the
+        figures can import modules from /lib.
+
+    """
+
+    def __init__(self, directory: pathlib.Path):
+        self.directory = directory
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server, e.g., "http://127.0.0.1:43567"."""
+        if self._httpd is None:
+            raise RuntimeError("The server has not been started.")
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, timeout: float = 10):
+        """Starts the server and waits until it is ready.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The number of seconds to wait for the server to become ready. Default
+            is 10.
+
+        Raises
+        ------
+        TimeoutError
+            If the server does not become ready in time.
+
+        """
+        with profiling.phase("genfig.js.server_start"):
+            handler = functools.partial(_QuietHandler, directory=str(self.directory))
+            self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            self._httpd.daemon_threads = True
+            self._thread = threading.Thread(
+                target=self._httpd.serve_forever, daemon=True
+            )
+            self._thread.start()
+            self._wait_until_ready(timeout)
+
+    def _wait_until_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen(self.url, timeout=timeout):
+                    return
+            except (urllib.error.URLError, ConnectionError):
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise TimeoutError("The figure server did not become ready.")
+                time.sleep(0.01)
+
+    def stop(self):
+        """Stops the server, if it is running."""
+        if self._httpd is None:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self) -> "FigureServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,163 @@
+"""Provides `SourceHasher` for deriving cache keys from the sources of JS figures."""
+
+import hashlib
+import json
+import pathlib
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ._preview import _read_preview_template, _use_vendored_assets
+
+# matches the module specifiers of imports, re-exports, and dynamic imports, e.g.,
+# `import { Plot } from "../../lib/ml4p/main.js"` or `import("./helpers.js")`
+_IMPORT_PATTERN = re.compile(r"""(?:\bfrom|\bimport\s*\(?)\s*["']([^"']+)["']""")
+
+# matches the root-relative scripts and stylesheets loaded by the preview, e.g.,
+# `<script src="/lib/p5/p5.min.js">` or the vendored copies of the CDN assets.
+# Sources containing template placeholders are skipped; the figure itself is hashed
+# separately
+_LOCAL_ASSET_PATTERN = re.compile(
+    r"""<(?:script|link)[^>]*\s(?:src|href)=["'](/[^"'$]+)["']"""
+)
+
+
+class SourceHasher:
+    """Computes cache keys for static figures from the contents of their sources.
+
+    The key of a figure covers its `main.js`, every module that it imports
+    (transitively, so shared code in /vis/js/lib is included), the preview template
+    along with the scripts and stylesheets that it loads (such as p5 and the
+    vendored copies of the CDN assets, if any), and the figure's options.
+    Because the key depends only on file contents, it survives git checkouts that
+    reset modification times.
+
+    Each file is read and hashed at most once per hasher, so a single hasher should
+    be shared by all of the figures generated in a build.
+
+    Parameters
+    ----------
+    root : pathlib.Path
+        The /vis/js directory. Root-relative module specifiers and script sources
+        are resolved against it, as they are by the webserver.
+
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root.resolve()
+        self._scanned: Dict[pathlib.Path, Tuple[bytes, List[pathlib.Path]]] = {}
+        self._figure_hashes: Dict[pathlib.Path, str] = {}
+
+    def _resolve(
+        self, specifier: str, importer: Optional[pathlib.Path] = None
+    ) -> Optional[pathlib.Path]:
+        if specifier.startswith("/"):
+            return (self.root / specifier.lstrip("/")).resolve()
+        if specifier.startswith(".") and importer is not None:
+            return (importer.parent / specifier).resolve()
+        # bare specifiers (e.g., URLs or package names) are not local files
+        return None
+
+    def _scan(self, path: pathlib.Path) -> Tuple[bytes, List[pathlib.Path]]:
+        """Hashes the file and finds the local modules that it imports."""
+        if path not in self._scanned:
+            contents = path.read_bytes()
+            imports = []
+            if path.suffix == ".js" and not path.name.endswith(".min.js"):
+                for specifier in _IMPORT_PATTERN.findall(contents.decode()):
+                    resolved = self._resolve(specifier, importer=path)
+                    if resolved is not None:
+                        imports.append(resolved)
+            self._scanned[path] = (hashlib.md5(contents).digest(), imports)
+        return self._scanned[path]
+
+    def _dependencies(self, entry_points: Iterable[pathlib.Path]) -> List[pathlib.Path]:
+        """The entry points and all of the files they import, transitively."""
+        seen = set()
+        stack = list(entry_points)
+        while stack:
+            path = stack.pop()
+            if path in seen:
+                continue
+            seen.add(path)
+            stack.extend(self._scan(path)[1])
+        return sorted(seen)
+
+    def module_files(self, figure_directory: pathlib.Path) -> List[pathlib.Path]:
+        """Finds the figure's `main.js` and every local module that it imports.
+
+        Modules are found transitively, so shared code in /vis/js/lib is included.
+        Scripts loaded by the preview template, such as p5, are not.
+
+        Parameters
+        ----------
+        figure_directory : pathlib.Path
+            The directory containing the figure.
+
+        Returns
+        -------
+        List[pathlib.Path]
+            The resolved paths of the modules, sorted.
+
+        """
+        return self._dependencies([figure_directory.resolve() / "main.js"])
+
+    def figure_hash(self, figure_directory: pathlib.Path) -> str:
+        """Hashes the sources of the figure, independent of its options.
+
+        Parameters
+        ----------
+        figure_directory : pathlib.Path
+            The directory containing the figure.
+
+        Returns
+        -------
+        str
+            The hash as a hexadecimal string.
+
+        """
+        figure_directory = figure_directory.resolve()
+        if figure_directory not in self._figure_hashes:
+            # hashed as served, i.e., loading the vendored assets if there are any
+            template = _use_vendored_assets(_read_preview_template(), self.root)
+            entry_points = [figure_directory / "main.js"] + [
+                self._resolve(src) for src in _LOCAL_ASSET_PATTERN.findall(template)
+            ]
+
+            digest = hashlib.md5(template.encode())
+            for path in self._dependencies(entry_points):
+                digest.update(path.relative_to(self.root).as_posix().encode())
+                digest.update(self._scan(path)[0])
+
+            self._figure_hashes[figure_directory] = digest.hexdigest()
+
+        return self._figure_hashes[figure_directory]
+
+    def figure_key(
+        self,
+        figure_directory: pathlib.Path,
+        figure_options: dict,
+        settings: Optional[dict] = None,
+    ) -> str:
+        """Computes the cache key of the figure rendered with the given options.
+
+        Parameters
+        ----------
+        figure_directory : pathlib.Path
+            The directory containing the figure.
+        figure_options : dict
+            Options for the figure.
+        settings : dict, optional
+            Any other settings that affect the rendered images, such as how they
+            are captured. Must be serializable to JSON. Default is None.
+
+        Returns
+        -------
+        str
+            The key as a hexadecimal string.
+
+        """
+        digest = hashlib.md5(self.figure_hash(figure_directory).encode())
+        digest.update(json.dumps(figure_options, sort_keys=True).encode())
+        if settings:
+            digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
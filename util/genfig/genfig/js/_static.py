@@ -1,62 +1,96 @@
-"""Provides `generate_static()` for creating PNGs from JavaScript figures."""
+"""Provides `generate_static()` and `generate_static_many()` for creating PNGs."""
 
+import base64
 import pathlib
-import json
-import subprocess
-import hashlib
+import os
+import threading
 import time
-from typing import Optional
+from typing import Callable, Optional, Tuple, Sequence, List
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import selenium.webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
 
 from PIL import Image
 
+from .. import profiling
+from .._images import (
+    THEMES,
+    save_static_images,
+    static_images_exist,
+    validate_image_settings,
+)
 from ._preview import make_preview
+from ._browser import DriverPool
+from ._sources import SourceHasher
+from ._server import FigureServer
 
-PORT = 5010
+# the ways in which the image of a figure can be captured; see `generate_static()`
+CAPTURE_MODES = ("screenshot", "canvas")
 
+# the time in seconds between samples of the canvas when waiting for it to settle
+STABILITY_POLL_INTERVAL = 0.1
 
-def _start_webserver(directory: pathlib.Path):
-    process = subprocess.Popen(
-        ["python", "-m", "http.server", str(PORT)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        cwd=directory,
-    )
-    return process
 
+def _wait_for_stable_canvas(driver: selenium.webdriver.Chrome, timeout: float):
+    """Polls the canvas until two consecutive samples of its pixels are identical.
 
-def _take_browser_screenshot(
-    figure_directory: pathlib.Path, theme: str = "light", delay: float = 0
-) -> Image.Image:
-    options = Options()
-    options.add_argument("--headless")  # Ensure GUI is off
-    options.add_argument("--no-sandbox")
+    Used for figures that do not signal when they are done drawing. If the canvas
+    never settles (e.g., the figure is animated), this gives up after `timeout`.
 
-    # Include the path to your ChromeDriver if necessary
-    driver = selenium.webdriver.Chrome(options=options)
+    """
+    deadline = time.monotonic() + timeout
+    previous = None
+    while time.monotonic() < deadline:
+        current = driver.execute_script(
+            "let canvas = document.querySelector('canvas');"
+            "return canvas ? canvas.toDataURL() : null;"
+        )
+        if current is not None and current == previous:
+            return
+        previous = current
+        time.sleep(STABILITY_POLL_INTERVAL)
+
+
+def _wait_for_render(driver: selenium.webdriver.Chrome, timeout: float):
+    """Waits until the figure on the current page has finished drawing.
+
+    Figures created with `setupStatic()` from /vis/js/lib/ml4p signal when their
+    frame is done; for these, we wait on the signal. Otherwise, or if the signal
+    does not arrive within `timeout`, we fall back to waiting for the canvas to
+    stop changing.
+
+    """
+    start = time.monotonic()
+    if driver.execute_script("return window.ml4pSignalsFrameDone === true"):
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.01).until(
+                lambda d: d.execute_script("return window.ml4pFrameDone === true")
+            )
+            return
+        except TimeoutException:
+            pass
+
+    _wait_for_stable_canvas(driver, max(0, timeout - (time.monotonic() - start)))
 
-    # open the file
-    driver.get(
-        f"http://127.0.0.1:{PORT}/figures/{figure_directory.name}/_build/preview-static.html"
-    )
 
-    # run some JavaScript to set the theme
-    driver.execute_script(f"FIGTHEME = '{theme}'")
+def _capture_screenshot(driver: selenium.webdriver.Chrome) -> Image.Image:
+    """Screenshots the page and crops it to the figure's canvas.
 
+    Anything drawn over the canvas, such as TeX labels positioned with `PlotTeX`, is
+    included in the image.
+
+    """
     elem = driver.find_element(By.ID, "defaultCanvas0")
     pixel_ratio = driver.execute_script("return window.devicePixelRatio")
 
     location = elem.location
     size = elem.size
 
-    # give some time for the canvas to render
-    time.sleep(delay)
     png = driver.get_screenshot_as_png()  # saves screenshot of entire page
-    driver.quit()
 
     left = location["x"] * pixel_ratio
     top = location["y"] * pixel_ratio + 1
@@ -69,82 +103,183 @@ def _take_browser_screenshot(
     return img
 
 
-def _stop_webserver(process):
-    process.terminate()
+# composites every canvas in the figure's container onto a single canvas, preserving
+# their layout on the page, and returns it as a base64-encoded PNG
+_EXPORT_CANVASES_SCRIPT = """
+let canvases = Array.from(document.querySelectorAll("#preview canvas"));
+if (canvases.length === 0) {
+  return null;
+}
 
+let rects = canvases.map((canvas) => canvas.getBoundingClientRect());
+let left = Math.min(...rects.map((rect) => rect.left));
+let top = Math.min(...rects.map((rect) => rect.top));
+let right = Math.max(...rects.map((rect) => rect.right));
+let bottom = Math.max(...rects.map((rect) => rect.bottom));
 
-def _make_figure_basename(figure_options: dict) -> str:
-    if figure_options:
-        opts_json = json.dumps(figure_options, sort_keys=True)
-        return "figure-" + hashlib.md5(opts_json.encode()).hexdigest()
-    else:
-        return "figure"
+// the number of canvas pixels per CSS pixel; p5 sizes its backing store by the
+// device pixel ratio
+let scale = Math.max(...canvases.map((canvas, i) => canvas.width / rects[i].width));
 
+let output = document.createElement("canvas");
+output.width = Math.round((right - left) * scale);
+output.height = Math.round((bottom - top) * scale);
 
-def _get_modification_time(file: pathlib.Path) -> float:
-    return file.stat().st_mtime
+let context = output.getContext("2d");
+canvases.forEach((canvas, i) => {
+  context.drawImage(
+    canvas,
+    (rects[i].left - left) * scale,
+    (rects[i].top - top) * scale,
+    rects[i].width * scale,
+    rects[i].height * scale,
+  );
+});
 
+return output.toDataURL("image/png").split(",")[1];
+"""
 
-def _get_most_recent_modification_time_in(
-    directory: pathlib.Path, extensions=None
-) -> float:
-    """Retrieves the most recent modification time of files in the directory.
 
-    Parameters
-    ----------
-    directory : pathlib.Path
-        The directory to search.
-    extensions : list, optional
-        A list of file extensions to search for. Default is None, in which case all
-        files are searched.
+def _capture_canvas(driver: selenium.webdriver.Chrome) -> Image.Image:
+    """Exports the pixels of the figure's canvases directly from the page.
 
-    Returns
-    -------
-    float
-        The most recent modification time as a UNIX timestamp.
+    This avoids screenshotting the whole viewport and gives exact bounds, and it
+    works with any number of canvases with any ids. However, only what is drawn on
+    the canvases is captured: DOM elements overlaid on them (such as `PlotTeX`
+    labels) are not.
 
     """
-    if extensions is None:
-        extensions = ["*"]
-
-    most_recent_modification_time = 0
-    for ext in extensions:
-        for file in directory.glob(f"**/*.{ext}"):
-            most_recent_modification_time = max(
-                most_recent_modification_time, _get_modification_time(file)
-            )
+    data = driver.execute_script(_EXPORT_CANVASES_SCRIPT)
+    if data is None:
+        raise RuntimeError("The figure did not create a canvas.")
+    return Image.open(BytesIO(base64.b64decode(data)))
+
+
+def _take_browser_screenshot(
+    driver: selenium.webdriver.Chrome,
+    server: FigureServer,
+    figure_directory: pathlib.Path,
+    preview_filename: str,
+    theme: str = "light",
+    delay: float = 0,
+    timeout: float = 10,
+    capture: str = "screenshot",
+    pixel_ratio: float = 2,
+) -> Image.Image:
+    # render at the requested pixel ratio, regardless of the (headless) display's
+    driver.execute_cdp_cmd(
+        "Emulation.setDeviceMetricsOverride",
+        {"width": 0, "height": 0, "deviceScaleFactor": pixel_ratio, "mobile": False},
+    )
 
-    return most_recent_modification_time
+    # open the file; the preview reads the theme from the query string
+    with profiling.phase("genfig.js.load"):
+        driver.get(
+            f"{server.url}/figures/{figure_directory.name}/_build/{preview_filename}"
+            f"?theme={theme}"
+        )
+        _wait_for_render(driver, timeout)
 
+    # give some extra time for the canvas to render, if requested
+    with profiling.phase("genfig.js.delay"):
+        time.sleep(delay)
 
-def _is_up_to_date(figure_directory: pathlib.Path, figbasename: str) -> bool:
-    dark_filename = figure_directory / "_build" / f"{figbasename}-dark.png"
-    light_filename = figure_directory / "_build" / f"{figbasename}-light.png"
+    with profiling.phase("genfig.js.capture"):
+        if capture == "canvas":
+            return _capture_canvas(driver)
+        else:
+            return _capture_screenshot(driver)
 
-    if not dark_filename.exists() or not light_filename.exists():
-        return False
 
-    most_recent_modification_time = _get_most_recent_modification_time_in(
-        figure_directory, extensions=["js"]
-    )
+@profiling.timed("genfig.js.render")
+def _render(
+    figure_directory: pathlib.Path,
+    figure_options: dict,
+    figbasename: str,
+    pool: DriverPool,
+    server: FigureServer,
+    delay: float,
+    timeout: float,
+    capture: str,
+    formats: Sequence[str],
+    pixel_ratios: Sequence[float],
+):
+    """Renders the images of the figure into its _build directory.
+
+    A light and a dark image is rendered at each pixel ratio and saved in each
+    format. Assumes that the server is already running. Each set of options gets
+    its own preview page, so several renders of the same figure can run at once.
 
-    return (
-        _get_modification_time(dark_filename) > most_recent_modification_time
-        and _get_modification_time(light_filename) > most_recent_modification_time
+    """
+    preview_filename = f"preview-static-{figbasename}.html"
+    make_preview(
+        figure_directory,
+        dynamic=False,
+        figure_options=figure_options,
+        filename=preview_filename,
     )
 
+    images = {}
+    with pool.driver() as driver:
+        for pixel_ratio in pixel_ratios:
+            for theme in THEMES:
+                images[(pixel_ratio, theme)] = _take_browser_screenshot(
+                    driver,
+                    server,
+                    figure_directory,
+                    preview_filename,
+                    theme=theme,
+                    delay=delay,
+                    timeout=timeout,
+                    capture=capture,
+                    pixel_ratio=pixel_ratio,
+                )
+
+    with profiling.phase("genfig.js.save"):
+        save_static_images(figure_directory / "_build", figbasename, images, formats)
+
+
+def _validate_settings(
+    capture: str, formats: Sequence[str], pixel_ratios: Sequence[float]
+):
+    if capture not in CAPTURE_MODES:
+        raise ValueError(
+            f"Invalid capture mode '{capture}'. Must be one of {CAPTURE_MODES}."
+        )
+
+    validate_image_settings(formats, pixel_ratios)
+
+
+@profiling.timed("genfig.js.hash")
+def _make_figure_basename(
+    figure_directory: pathlib.Path,
+    figure_options: dict,
+    hasher: SourceHasher,
+    capture: str,
+) -> str:
+    settings = {"capture": capture}
+    return "figure-" + hasher.figure_key(figure_directory, figure_options, settings)
+
 
 def generate_static(
     figure_directory: pathlib.Path,
     figure_options: Optional[dict] = None,
     cache: bool = True,
     delay: float = 0,
+    timeout: float = 10,
+    capture: str = "screenshot",
+    formats: Sequence[str] = ("png",),
+    pixel_ratios: Sequence[float] = (2,),
+    pool: Optional[DriverPool] = None,
+    hasher: Optional[SourceHasher] = None,
+    server: Optional[FigureServer] = None,
 ) -> str:
     """Generates static figures from the JavaScript.
 
-    This works by 1) making an HTML preview of the figure, 2) starting a webserver in
-    the /vis/js directory (to serve the javascript modules), 3) opening the preview in
-    a headless browser and taking a screenshot of the canvas.
+    This works by 1) making an HTML preview of the figure, 2) serving the /vis/js
+    directory over HTTP (to serve the javascript modules), 3) opening the preview in
+    a headless browser, waiting for the figure to finish drawing, and taking a
+    screenshot of the canvas.
 
     Parameters
     ----------
@@ -153,34 +288,274 @@ def generate_static(
     figure_options : dict, optional
         Options for the figure. Default is None.
     cache : bool, optional
-        Whether to cache the figure. This will check the modification time of
-        all of the .js files in the figure directory against the output static
-        image (if it exists), and will only regenerate the image if the .js
-        files are newer. Default is True.
+        Whether to cache the figure. The basename of the figure is derived from a
+        hash of its options and of the contents of its sources: its .js files, the
+        modules they import from /vis/js/lib, and the preview template. If images
+        with that basename already exist, they are reused instead of regenerated.
+        Default is True.
     delay : float, optional
-        The delay in seconds to wait before taking the screenshot. Default is 0.
+        An extra delay in seconds to wait before taking the screenshot, after the
+        figure has finished drawing. Default is 0.
+    timeout : float, optional
+        The maximum time in seconds to wait for the figure to finish drawing.
+        Figures created with `setupStatic()` signal when they are done; for others,
+        the canvas is polled until it stops changing. Default is 10.
+    capture : str, optional
+        How the image is captured. If "screenshot", the page is screenshotted and
+        cropped to the canvas, which includes DOM elements drawn over the canvas,
+        such as TeX labels. If "canvas", the pixels of all of the figure's canvases
+        are exported directly, which is faster and exact but omits any DOM
+        elements. Default is "screenshot".
+    formats : Sequence[str], optional
+        The formats to save the images in: any of those returned by
+        :func:`supported_formats`. PNGs are optimized and WebPs are lossless.
+        Default is ("png",).
+    pixel_ratios : Sequence[float], optional
+        The device pixel ratios to render the figure at, e.g., (1, 2, 3) for
+        displays of increasing density. Default is (2,).
+    pool : DriverPool, optional
+        The pool of headless browsers to take the screenshots with. Default is None,
+        in which case a single browser is launched for this call and quit
+        afterwards. Pass a shared pool when generating many figures so that the
+        browsers are reused across calls.
+    hasher : SourceHasher, optional
+        The hasher used to compute the cache key. Default is None, in which case a
+        new one is created. Pass a shared hasher when generating many figures so
+        that each source file is hashed only once.
+    server : FigureServer, optional
+        A running server for the /vis/js directory containing the figure. Default is
+        None, in which case a server is started for this call and stopped
+        afterwards.
 
     Returns
     -------
     str
-        The basename of the figure. E.g., "figure-<hash>". Does not contain the file
-        extension.
+        The basename of the figure. E.g., "figure-<hash>". The filenames of the
+        images are given by :func:`static_image_filename`, and the size at which
+        to display them by :func:`get_static_size`.
     """
+    _validate_settings(capture, formats, pixel_ratios)
+
     if figure_options is None:
         figure_options = {}
 
-    figbasename = _make_figure_basename(figure_options)
+    if hasher is None:
+        hasher = SourceHasher(figure_directory.parent.parent)
 
-    if cache and _is_up_to_date(figure_directory, figbasename):
-        return figbasename
+    figbasename = _make_figure_basename(
+        figure_directory, figure_options, hasher, capture
+    )
 
-    make_preview(figure_directory, dynamic=False, figure_options=figure_options)
-    process = _start_webserver(figure_directory.parent.parent)
-    img_light = _take_browser_screenshot(figure_directory, theme="light", delay=delay)
-    img_dark = _take_browser_screenshot(figure_directory, theme="dark", delay=delay)
-    _stop_webserver(process)
+    if cache and static_images_exist(
+        figure_directory, figbasename, formats, pixel_ratios
+    ):
+        profiling.count("genfig.js.cache_hits")
+        return figbasename
 
-    img_light.save(figure_directory / "_build" / f"{figbasename}-light.png")
-    img_dark.save(figure_directory / "_build" / f"{figbasename}-dark.png")
+    profiling.count("genfig.js.cache_misses")
+
+    owns_pool = pool is None
+    if owns_pool:
+        pool = DriverPool(size=1)
+
+    owns_server = server is None
+    if owns_server:
+        server = FigureServer(figure_directory.parent.parent)
+        server.start()
+
+    try:
+        _render(
+            figure_directory,
+            figure_options,
+            figbasename,
+            pool,
+            server,
+            delay,
+            timeout,
+            capture,
+            formats,
+            pixel_ratios,
+        )
+    finally:
+        if owns_server:
+            server.stop()
+        if owns_pool:
+            pool.close()
 
     return figbasename
+
+
+def generate_static_many(
+    figures: Sequence[Tuple[pathlib.Path, Optional[dict]]],
+    cache: bool = True,
+    delay: float = 0,
+    timeout: float = 10,
+    capture: str = "screenshot",
+    formats: Sequence[str] = ("png",),
+    pixel_ratios: Sequence[float] = (2,),
+    pool: Optional[DriverPool] = None,
+    max_workers: Optional[int] = None,
+    hasher: Optional[SourceHasher] = None,
+    server: Optional[FigureServer] = None,
+    progress: Optional[Callable] = None,
+) -> List[str]:
+    """Generates static figures for many (figure, options) pairs concurrently.
+
+    This is equivalent to calling :func:`generate_static` on each pair, except that
+    the server is started only once and the figures that are out of date are
+    rendered in parallel, each worker borrowing a browser from the pool.
+
+    Parameters
+    ----------
+    figures : Sequence[Tuple[pathlib.Path, Optional[dict]]]
+        The figure directories and their options. All figures must be in the same
+        /vis/js/figures directory.
+    cache : bool, optional
+        Whether to skip figures whose images are up to date. See
+        :func:`generate_static`. Default is True.
+    delay : float, optional
+        An extra delay in seconds to wait before taking each screenshot. See
+        :func:`generate_static`. Default is 0.
+    timeout : float, optional
+        The maximum time in seconds to wait for each figure to finish drawing. See
+        :func:`generate_static`. Default is 10.
+    capture : str, optional
+        How the images are captured. See :func:`generate_static`. Default is
+        "screenshot".
+    formats : Sequence[str], optional
+        The formats to save the images in. See :func:`generate_static`. Default is
+        ("png",).
+    pixel_ratios : Sequence[float], optional
+        The device pixel ratios to render the figures at. See
+        :func:`generate_static`. Default is (2,).
+    pool : DriverPool, optional
+        The pool of headless browsers to render with. Default is None, in which case
+        a pool with `max_workers` browsers is created for this call and closed
+        afterwards.
+    max_workers : int, optional
+        The number of figures rendered at once. Default is None, in which case the
+        size of the pool is used, or the number of CPUs if no pool is given.
+    hasher : SourceHasher, optional
+        The hasher used to compute the cache keys. Default is None, in which case a
+        new one is created and shared by all of the figures.
+    server : FigureServer, optional
+        A running server for the /vis/js directory containing the figures. Default
+        is None, in which case a server is started for this call and stopped
+        afterwards.
+    progress : Callable, optional
+        Called after each figure that needed rendering has been rendered (or has
+        failed to render) as `progress(done, total, figure_directory,
+        figure_options, seconds, error)`, where `done` is the number of figures
+        finished so far out of `total`, `seconds` is the time the figure took, and
+        `error` is the exception raised while rendering, or None. Calls are made
+        from the worker threads, but never concurrently. Default is None.
+
+    Returns
+    -------
+    List[str]
+        The basename of each figure, in the same order as `figures`.
+
+    Raises
+    ------
+    ValueError
+        If no server is given and the figures are not all in the same directory.
+
+    """
+    _validate_settings(capture, formats, pixel_ratios)
+
+    basenames = []
+    jobs = {}
+    for figure_directory, figure_options in figures:
+        if figure_options is None:
+            figure_options = {}
+
+        if hasher is None:
+            hasher = SourceHasher(figure_directory.parent.parent)
+
+        figbasename = _make_figure_basename(
+            figure_directory, figure_options, hasher, capture
+        )
+        basenames.append(figbasename)
+
+        if cache and static_images_exist(
+            figure_directory, figbasename, formats, pixel_ratios
+        ):
+            profiling.count("genfig.js.cache_hits")
+            continue
+
+        profiling.count("genfig.js.cache_misses")
+
+        # duplicate pairs are rendered only once
+        jobs[(figure_directory, figbasename)] = figure_options
+
+    if not jobs:
+        return basenames
+
+    if max_workers is None:
+        max_workers = pool.size if pool is not None else os.cpu_count() or 1
+
+    owns_pool = pool is None
+    if owns_pool:
+        pool = DriverPool(size=max_workers)
+
+    owns_server = server is None
+    if owns_server:
+        roots = {figure_directory.parent.parent for figure_directory, _ in jobs}
+        if len(roots) > 1:
+            raise ValueError("All figures must be in the same figures directory.")
+        server = FigureServer(roots.pop())
+        server.start()
+
+    progress_lock = threading.Lock()
+    done = 0
+
+    def render(figure_directory, figure_options, *args):
+        nonlocal done
+        start = time.perf_counter()
+        error = None
+        try:
+            _render(figure_directory, figure_options, *args)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            if progress is not None:
+                with progress_lock:
+                    done += 1
+                    seconds = time.perf_counter() - start
+                    progress(
+                        done,
+                        len(jobs),
+                        figure_directory,
+                        figure_options,
+                        seconds,
+                        error,
+                    )
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    render,
+                    figure_directory,
+                    figure_options,
+                    figbasename,
+                    pool,
+                    server,
+                    delay,
+                    timeout,
+                    capture,
+                    formats,
+                    pixel_ratios,
+                )
+                for (figure_directory, figbasename), figure_options in jobs.items()
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        if owns_server:
+            server.stop()
+        if owns_pool:
+            pool.close()
+
+    return basenames
@@ -0,0 +1,129 @@
+"""Provides `find_jsfig_usages()` for finding the JS figures used by the book."""
+
+import json
+import pathlib
+import re
+from typing import Dict, List
+
+# matches the first line of a jsfig directive, e.g., `.. jsfig:: 1d-risk`
+_DIRECTIVE_PATTERN = re.compile(r"^(\s*)\.\.\s+jsfig::\s+(\S+)\s*$")
+
+# matches a directive option, e.g., `:html_output: static`
+_OPTION_PATTERN = re.compile(r"^:([\w-]+):\s*(.*)$")
+
+
+def _indentation(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+class JSFigureUsage:
+    """A use of the `jsfig` directive in the book's reST source.
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        The reST file containing the directive.
+    lineno : int
+        The (1-based) line number of the directive in the file.
+    figure_name : str
+        The name of the figure, i.e., the directive's argument.
+    options : Dict[str, str]
+        The directive's options, such as `html_output`.
+    content : str
+        The directive's content: the figure options, as JSON.
+
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        lineno: int,
+        figure_name: str,
+        options: Dict[str, str],
+        content: str,
+    ):
+        self.path = path
+        self.lineno = lineno
+        self.figure_name = figure_name
+        self.options = options
+        self.content = content
+
+    @property
+    def html_output(self) -> str:
+        """Either "static" or "dynamic", as in the jsfig directive."""
+        return self.options.get("html_output", "dynamic").lower()
+
+    @property
+    def location(self) -> str:
+        """The location of the directive, e.g., "book/index.rst:26"."""
+        return f"{self.path}:{self.lineno}"
+
+    def figure_options(self) -> dict:
+        """Parses the figure options from the directive's content.
+
+        Raises
+        ------
+        ValueError
+            If the content is not valid JSON.
+
+        """
+        return json.loads(self.content) if self.content else {}
+
+
+def _parse_directive(path: pathlib.Path, lines: List[str], start: int) -> JSFigureUsage:
+    match = _DIRECTIVE_PATTERN.match(lines[start])
+    indent = len(match.group(1))
+
+    # the body of the directive is every following line that is blank or indented
+    # further than the directive itself
+    body = []
+    for line in lines[start + 1 :]:
+        if line.strip() and _indentation(line) <= indent:
+            break
+        body.append(line)
+
+    # the options come first, followed by the content
+    options = {}
+    content_lines = []
+    in_options = True
+    for line in body:
+        option = _OPTION_PATTERN.match(line.strip())
+        if in_options and option:
+            options[option.group(1)] = option.group(2).strip()
+        else:
+            in_options = False
+            content_lines.append(line)
+
+    return JSFigureUsage(
+        path,
+        start + 1,
+        match.group(2),
+        options,
+        "\n".join(content_lines).strip(),
+    )
+
+
+def find_jsfig_usages(book_directory: pathlib.Path) -> List[JSFigureUsage]:
+    """Finds every use of the `jsfig` directive in the book's reST sources.
+
+    Directives are found anywhere in a file, including when they are nested in
+    other directives, such as exercises.
+
+    Parameters
+    ----------
+    book_directory : pathlib.Path
+        The book's source directory.
+
+    Returns
+    -------
+    List[JSFigureUsage]
+        The uses, ordered by file and then line.
+
+    """
+    usages = []
+    for path in sorted(book_directory.glob("**/*.rst")):
+        lines = path.read_text().splitlines()
+        for i, line in enumerate(lines):
+            if _DIRECTIVE_PATTERN.match(line):
+                usages.append(_parse_directive(path, lines, i))
+    return usages
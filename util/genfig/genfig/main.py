@@ -1,16 +1,211 @@
 import argparse
+import json
 import pathlib
+import sys
 
-from . import js
+from . import js, py, vendor
 
 
 def js_make_preview(args):
     print("Making preview for JavaScript figure...")
     js.make_preview(pathlib.Path.cwd())
 
+
 def js_generate_static(args):
+    if args.all:
+        js_generate_static_all(args)
+        return
+
     print("Generating static figures from JavaScript...")
-    js.generate_static(pathlib.Path.cwd())
+    js.generate_static(
+        pathlib.Path.cwd(),
+        cache=not args.force,
+        capture=args.capture,
+        formats=args.formats,
+        pixel_ratios=args.pixel_ratios,
+    )
+
+
+def py_generate_static(args):
+    if args.all:
+        py_generate_static_all(args)
+        return
+
+    print("Generating static figures from Python...")
+    py.generate_static(
+        pathlib.Path.cwd(),
+        cache=not args.force,
+        formats=args.formats,
+        pixel_ratios=args.pixel_ratios,
+    )
+
+
+def py_generate_static_all(args):
+    """Renders every Python figure in /vis/py, in parallel."""
+    figures_directory = _find_project_root(pathlib.Path.cwd()) / "vis" / "py"
+    figures = [(d, {}) for d in py.find_figures(figures_directory)]
+
+    print(f"Found {len(figures)} Python figure(s) in {figures_directory}.")
+    with py.WorkerPool(size=args.jobs) as workers:
+        try:
+            _generate_all(
+                py.generate_static_many,
+                figures,
+                [],
+                cache=not args.force,
+                formats=args.formats,
+                pixel_ratios=args.pixel_ratios,
+                workers=workers,
+            )
+        finally:
+            _report_startup_times(workers)
+
+
+def _report_startup_times(workers: py.WorkerPool):
+    times = list(workers.startup_times.values())
+    if times:
+        print(
+            f"Started {len(times)} worker(s); importing the plotting libraries took "
+            f"{sum(times) / len(times):.2f}s per worker."
+        )
+
+
+def vendor_assets(args):
+    """Downloads the assets the book and the previews load from CDNs."""
+    vendor_directory = (
+        _find_project_root(pathlib.Path.cwd()) / "vis" / "js" / vendor.VENDOR_DIRECTORY
+    )
+    print(f"Vendoring {len(vendor.VENDORED_ASSETS)} asset(s) into {vendor_directory}.")
+    sizes = vendor.vendor_assets(vendor_directory)
+    print(f"Wrote {len(sizes)} file(s), {sum(sizes.values()) / 1e6:.1f} MB in total.")
+
+
+def _find_project_root(start: pathlib.Path) -> pathlib.Path:
+    """Walks up from `start` to the directory containing /vis/js/figures."""
+    for directory in [start, *start.parents]:
+        if (directory / "vis" / "js" / "figures").is_dir():
+            return directory
+    raise RuntimeError(f"{start} is not inside the ml4p repository.")
+
+
+def _format_options(figure_options: dict, width: int = 40) -> str:
+    text = json.dumps(figure_options, sort_keys=True)
+    return text if len(text) <= width else text[: width - 3] + "..."
+
+
+def _generate_all(generate_static_many, figures, failures, **kwargs):
+    """Renders the figures with progress reports, exiting with 1 on failure.
+
+    `failures` lists the problems found before rendering, such as invalid options;
+    they are reported along with any figures that fail to render.
+
+    """
+    failures = list(failures)
+    rendered = 0
+    failed = 0
+
+    # the errors passed to the progress callback; see below
+    reported = []
+
+    def progress(done, total, figure_directory, figure_options, seconds, error):
+        nonlocal rendered, failed
+        description = f"{figure_directory.name} {_format_options(figure_options)}"
+        if error is None:
+            rendered += 1
+            print(f"[{done}/{total}] {description} {seconds:.2f}s")
+        else:
+            failed += 1
+            reported.append(error)
+            print(f"[{done}/{total}] {description} FAILED after {seconds:.2f}s")
+            failures.append(f"{figure_directory.name}: {error}")
+
+    unreported = None
+    if figures:
+        try:
+            generate_static_many(figures, progress=progress, **kwargs)
+        except Exception as exc:
+            # errors raised while rendering a figure have already been reported by
+            # the progress callback; others, such as those raised while hashing the
+            # figures' sources, stopped the figures from being rendered at all
+            if not any(exc is error for error in reported):
+                unreported = exc
+                failures.append(f"{type(exc).__name__}: {exc}")
+
+    if unreported is None:
+        up_to_date = len(figures) - rendered - failed
+        print(f"{rendered} rendered, {up_to_date} up to date, {len(failures)} failed.")
+    else:
+        print(f"{rendered} rendered, {len(failures)} failed; rendering was aborted.")
+
+    if failures:
+        for failure in failures:
+            print(f"error: {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+def js_generate_static_all(args):
+    """Renders every static figure used by the book, in parallel."""
+    root = _find_project_root(pathlib.Path.cwd())
+    book_directory = args.book if args.book is not None else root / "book"
+    figures_directory = root / "vis" / "js" / "figures"
+
+    usage_failures = []
+    figures = {}
+    for usage in js.find_jsfig_usages(book_directory):
+        if usage.html_output != "static":
+            continue
+
+        try:
+            figure_options = usage.figure_options()
+        except ValueError as exc:
+            usage_failures.append(f"{usage.location}: invalid figure options: {exc}")
+            continue
+
+        figure_directory = figures_directory / usage.figure_name
+        if not (figure_directory / "main.js").is_file():
+            usage_failures.append(
+                f"{usage.location}: no such figure: {usage.figure_name}"
+            )
+            continue
+
+        key = (usage.figure_name, json.dumps(figure_options, sort_keys=True))
+        figures[key] = (figure_directory, figure_options)
+
+    print(f"Found {len(figures)} static figure(s) used in {book_directory}.")
+    _generate_all(
+        js.generate_static_many,
+        list(figures.values()),
+        usage_failures,
+        cache=not args.force,
+        capture=args.capture,
+        formats=args.formats,
+        pixel_ratios=args.pixel_ratios,
+        max_workers=args.jobs,
+    )
+
+
+def _add_rendering_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="the number of figures to render at once (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="render figures even if they are up to date",
+    )
+    # the defaults match those of the ml4p Sphinx extension, so that rendering
+    # ahead of time warms the cache used by the book build
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=sorted(js.IMAGE_FORMATS),
+        default=["webp", "png"],
+    )
+    parser.add_argument("--pixel-ratios", nargs="+", type=float, default=[1, 2])
 
 
 def setup_js_parser(js_parser: argparse.ArgumentParser):
@@ -20,9 +215,39 @@ def setup_js_parser(js_parser: argparse.ArgumentParser):
     make_preview_parser.set_defaults(func=js_make_preview)
 
     generate_static_parser = js_subparsers.add_parser("generate-static")
+    generate_static_parser.add_argument(
+        "--all",
+        action="store_true",
+        help="render every static figure used by the book, not just the figure in "
+        "the current directory",
+    )
+    generate_static_parser.add_argument(
+        "--book",
+        type=pathlib.Path,
+        default=None,
+        help="the book's source directory, used with --all (default: <repo>/book)",
+    )
+    generate_static_parser.add_argument(
+        "--capture", choices=js.CAPTURE_MODES, default="screenshot"
+    )
+    _add_rendering_arguments(generate_static_parser)
     generate_static_parser.set_defaults(func=js_generate_static)
 
 
+def setup_py_parser(py_parser: argparse.ArgumentParser):
+    py_subparsers = py_parser.add_subparsers(dest="subsubcommand")
+
+    generate_static_parser = py_subparsers.add_parser("generate-static")
+    generate_static_parser.add_argument(
+        "--all",
+        action="store_true",
+        help="render every figure in /vis/py, not just the figure in the current "
+        "directory",
+    )
+    _add_rendering_arguments(generate_static_parser)
+    generate_static_parser.set_defaults(func=py_generate_static)
+
+
 def main():
     parser = argparse.ArgumentParser()
 
@@ -33,6 +258,13 @@ def main():
     setup_js_parser(js_parser)
 
     py_parser = subparsers.add_parser("py")
+    setup_py_parser(py_parser)
+
+    vendor_parser = subparsers.add_parser(
+        "vendor",
+        help="download the assets the book loads from CDNs into /vis/js/lib/vendor",
+    )
+    vendor_parser.set_defaults(func=vendor_assets)
 
     args = parser.parse_args()
     if hasattr(args, "func"):
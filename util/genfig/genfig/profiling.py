@@ -0,0 +1,162 @@
+"""Opt-in timings of the phases of a build, and counts of what happened in them.
+
+Both genfig and the Sphinx extension are instrumented with :func:`phase`,
+:func:`timed` and :func:`count`. Until :func:`enable` is called, these do nothing
+beyond checking a flag, so the instrumentation costs nothing in normal builds.
+
+Phases may nest (e.g., rendering a page includes making its context), so the
+totals of different phases do not add up to the time the build took. Timings are
+recorded only in the process that enabled profiling: work done in worker
+processes, such as the readers and writers of a parallel Sphinx build, is not
+seen.
+
+"""
+
+import contextlib
+import functools
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, List, Optional
+
+_enabled = False
+_lock = threading.Lock()
+
+# the duration of every call of each phase, by phase name
+_phases: Dict[str, List[float]] = defaultdict(list)
+
+# the total time spent in each phase for each document, by document name
+_documents: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+_counters: Dict[str, int] = defaultdict(int)
+
+
+def enable():
+    """Starts recording timings and counts."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stops recording timings and counts. Those already recorded are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Discards everything recorded so far."""
+    with _lock:
+        _phases.clear()
+        _documents.clear()
+        _counters.clear()
+
+
+def record(name: str, seconds: float, document: Optional[str] = None):
+    """Records a call of a phase that was timed elsewhere.
+
+    Parameters
+    ----------
+    name : str
+        The name of the phase, e.g., "genfig.js.capture".
+    seconds : float
+        The time the call took.
+    document : str, optional
+        The document the call was made for, if any. Default is None.
+
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _phases[name].append(seconds)
+        if document is not None:
+            _documents[document][name] += seconds
+
+
+@contextlib.contextmanager
+def phase(name: str, document: Optional[str] = None) -> Iterator[None]:
+    """Times the body of the `with` block as a call of the phase `name`.
+
+    See :func:`record`.
+
+    """
+    if not _enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, document)
+
+
+def timed(name: str, document: Optional[Callable[..., str]] = None) -> Callable:
+    """Decorates a function so that each of its calls is timed as the phase `name`.
+
+    Parameters
+    ----------
+    name : str
+        The name of the phase.
+    document : Callable, optional
+        Called with the function's arguments to find the document the call is made
+        for. Default is None, in which case calls are not attributed to documents.
+
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            docname = None if document is None else document(*args, **kwargs)
+            with phase(name, docname):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    """Adds `n` to the counter `name`, e.g., "genfig.js.cache_hits"."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += n
+
+
+def report() -> dict:
+    """Summarizes everything recorded so far.
+
+    Returns
+    -------
+    dict
+        A JSON-serializable dictionary with the keys:
+
+        - "phases": for each phase, the number of "calls" and their "total",
+          "mean" and "max" durations in seconds;
+        - "documents": for each document, the total time spent in each phase;
+        - "counters": the value of each counter.
+
+    """
+    with _lock:
+        phases = {
+            name: {
+                "calls": len(durations),
+                "total": sum(durations),
+                "mean": sum(durations) / len(durations),
+                "max": max(durations),
+            }
+            for name, durations in sorted(_phases.items())
+        }
+        documents = {
+            document: dict(sorted(timings.items()))
+            for document, timings in sorted(_documents.items())
+        }
+        counters = dict(sorted(_counters.items()))
+
+    return {"phases": phases, "documents": documents, "counters": counters}
@@ -0,0 +1,4 @@
+from .._images import get_static_size, static_image_filename, supported_formats
+from ._figures import find_figures
+from ._static import generate_static, generate_static_many
+from ._worker import WorkerPool
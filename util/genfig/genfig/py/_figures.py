@@ -0,0 +1,21 @@
+"""Provides `find_figures()` for discovering the Python figures."""
+
+import pathlib
+from typing import List
+
+
+def find_figures(figures_root: pathlib.Path) -> List[pathlib.Path]:
+    """Finds every Python figure, i.e., every directory containing a `main.py`.
+
+    Parameters
+    ----------
+    figures_root : pathlib.Path
+        The /vis/py directory.
+
+    Returns
+    -------
+    List[pathlib.Path]
+        The figure directories, sorted by name.
+
+    """
+    return sorted(path.parent for path in figures_root.glob("*/main.py"))
@@ -0,0 +1,285 @@
+"""Provides `generate_static()` and `generate_static_many()` for Python figures."""
+
+import hashlib
+import json
+import os
+import pathlib
+import runpy
+from concurrent.futures import as_completed
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from .. import profiling
+from .._images import (
+    THEMES,
+    save_static_images,
+    static_images_exist,
+    validate_image_settings,
+)
+from ._worker import WorkerPool
+
+# the matplotlib style each theme is drawn in. Images are saved with transparent
+# backgrounds, so only the colors of the figure's lines and text matter
+THEME_STYLES = {"light": "default", "dark": "dark_background"}
+
+# the number of image pixels per inch of the figure at a pixel ratio of 1. With
+# this, a figure made with `plt.figure(figsize=(4, 2))` is displayed at 400x200 CSS
+# pixels, as it would be by matplotlib itself
+BASE_DPI = 100
+
+
+def _figure_basename(figure_directory: pathlib.Path, figure_options: dict) -> str:
+    """Derives the basename of the figure from its script and options.
+
+    Only the figure's `main.py` is hashed; changes to modules or data files that it
+    loads are not detected.
+
+    """
+    digest = hashlib.md5((figure_directory / "main.py").read_bytes())
+    digest.update(json.dumps(figure_options, sort_keys=True).encode())
+    digest.update(json.dumps(THEME_STYLES, sort_keys=True).encode())
+    digest.update(str(BASE_DPI).encode())
+    return "figure-" + digest.hexdigest()
+
+
+def _draw(
+    plt, figure_directory: pathlib.Path, figure_options: dict, pixel_ratios
+) -> Dict[Tuple[float, str], Image.Image]:
+    """Runs the figure's script and draws it in each theme at each pixel ratio."""
+    # the script is not run as __main__, so its `if __name__ == "__main__"` block
+    # is skipped
+    namespace = runpy.run_path(str(figure_directory / "main.py"), run_name="__genfig__")
+    if "setup" not in namespace:
+        raise RuntimeError(f"{figure_directory / 'main.py'} does not define setup().")
+
+    images = {}
+    for theme in THEMES:
+        plt.close("all")
+        with plt.style.context(THEME_STYLES[theme]):
+            namespace["setup"](**figure_options)
+            figure = plt.gcf()
+            for pixel_ratio in pixel_ratios:
+                buffer = BytesIO()
+                figure.savefig(
+                    buffer, format="png", dpi=BASE_DPI * pixel_ratio, transparent=True
+                )
+                images[(pixel_ratio, theme)] = Image.open(buffer)
+    return images
+
+
+def _render(
+    figure_directory: pathlib.Path,
+    figure_options: dict,
+    figbasename: str,
+    formats: Sequence[str],
+    pixel_ratios: Sequence[float],
+):
+    """Runs the figure's script and saves its images into its _build directory.
+
+    The script's `setup()` is called once per theme, with the figure options as
+    keyword arguments, and the current matplotlib figure is saved at each pixel
+    ratio.
+
+    """
+    # matplotlib is imported here rather than at the top of the module so that
+    # importing genfig (e.g., from the Sphinx extension) stays cheap
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    # the script may change rcParams or leave figures open; both are undone so that
+    # a worker process can go on to render other figures
+    try:
+        with matplotlib.rc_context():
+            images = _draw(plt, figure_directory, figure_options, pixel_ratios)
+    finally:
+        plt.close("all")
+
+    build_directory = figure_directory / "_build"
+    build_directory.mkdir(exist_ok=True)
+    save_static_images(build_directory, figbasename, images, formats)
+
+
+def generate_static(
+    figure_directory: pathlib.Path,
+    figure_options: Optional[dict] = None,
+    cache: bool = True,
+    formats: Sequence[str] = ("png",),
+    pixel_ratios: Sequence[float] = (2,),
+) -> str:
+    """Generates static images of a Python figure.
+
+    The figure is a directory containing a `main.py` that defines a `setup()`
+    function drawing the figure with matplotlib's pyplot interface. The script is
+    run in this process with the non-interactive Agg backend; `setup()` is called
+    once for the light theme and once for the dark theme, with each drawn in the
+    corresponding matplotlib style, and the current figure is saved.
+
+    Parameters
+    ----------
+    figure_directory : pathlib.Path
+        The directory containing the figure.
+    figure_options : dict, optional
+        Options for the figure, passed to `setup()` as keyword arguments. Default is
+        None.
+    cache : bool, optional
+        Whether to cache the figure. The basename of the figure is derived from a
+        hash of its `main.py` and its options. If images with that basename already
+        exist, they are reused instead of regenerated. Default is True.
+    formats : Sequence[str], optional
+        The formats to save the images in: any of those returned by
+        :func:`supported_formats`. Default is ("png",).
+    pixel_ratios : Sequence[float], optional
+        The device pixel ratios to render the figure at. Default is (2,).
+
+    Returns
+    -------
+    str
+        The basename of the figure. E.g., "figure-<hash>". The filenames of the
+        images are given by :func:`static_image_filename`, and the size at which
+        to display them by :func:`get_static_size`.
+
+    """
+    validate_image_settings(formats, pixel_ratios)
+
+    if figure_options is None:
+        figure_options = {}
+
+    figbasename = _figure_basename(figure_directory, figure_options)
+    if cache and static_images_exist(
+        figure_directory, figbasename, formats, pixel_ratios
+    ):
+        profiling.count("genfig.py.cache_hits")
+        return figbasename
+
+    profiling.count("genfig.py.cache_misses")
+    with profiling.phase("genfig.py.render"):
+        _render(figure_directory, figure_options, figbasename, formats, pixel_ratios)
+    return figbasename
+
+
+def generate_static_many(
+    figures: Sequence[Tuple[pathlib.Path, Optional[dict]]],
+    cache: bool = True,
+    formats: Sequence[str] = ("png",),
+    pixel_ratios: Sequence[float] = (2,),
+    max_workers: Optional[int] = None,
+    progress: Optional[Callable] = None,
+    workers: Optional[WorkerPool] = None,
+) -> List[str]:
+    """Generates static images of many Python figures concurrently.
+
+    Each figure is rendered as by :func:`generate_static`, but in a pool of warm
+    worker processes (see :class:`WorkerPool`), so that figures render in parallel
+    and the global state of pyplot is never shared between concurrent renders.
+    Figures that are up to date are skipped, and duplicate (figure, options) pairs
+    are rendered only once.
+
+    Parameters
+    ----------
+    figures : Sequence[Tuple[pathlib.Path, Optional[dict]]]
+        The (figure directory, figure options) pairs to generate.
+    cache : bool, optional
+        Whether to reuse existing images. See :func:`generate_static`. Default is
+        True.
+    formats : Sequence[str], optional
+        See :func:`generate_static`. Default is ("png",).
+    pixel_ratios : Sequence[float], optional
+        See :func:`generate_static`. Default is (2,).
+    max_workers : int, optional
+        The number of worker processes. Default is None, in which case the size of
+        `workers` is used or, if no pool is given, the number of CPUs.
+    progress : Callable, optional
+        Called after each figure that needed rendering has been rendered (or has
+        failed to render) as `progress(done, total, figure_directory,
+        figure_options, seconds, error)`, as in
+        :func:`genfig.js.generate_static_many`. Default is None.
+    workers : WorkerPool, optional
+        The pool of worker processes to render the figures in. Default is None, in
+        which case a pool is started for this call and closed afterwards. Pass a
+        shared pool when rendering figures repeatedly so that the workers, which
+        have already imported the plotting libraries, are reused across calls.
+
+    Returns
+    -------
+    List[str]
+        The basename of each figure, in the same order as `figures`.
+
+    Raises
+    ------
+    RuntimeError
+        If any figure fails to render. This is raised after every other figure
+        has been rendered.
+
+    """
+    validate_image_settings(formats, pixel_ratios)
+
+    basenames = []
+    jobs = {}
+    for figure_directory, figure_options in figures:
+        if figure_options is None:
+            figure_options = {}
+
+        figbasename = _figure_basename(figure_directory, figure_options)
+        basenames.append(figbasename)
+
+        if cache and static_images_exist(
+            figure_directory, figbasename, formats, pixel_ratios
+        ):
+            profiling.count("genfig.py.cache_hits")
+            continue
+
+        profiling.count("genfig.py.cache_misses")
+
+        # duplicate pairs are rendered only once
+        jobs[(figure_directory, figbasename)] = figure_options
+
+    if not jobs:
+        return basenames
+
+    if max_workers is None:
+        max_workers = workers.size if workers is not None else os.cpu_count() or 1
+
+    owns_workers = workers is None
+    if owns_workers:
+        workers = WorkerPool(size=min(max_workers, len(jobs)))
+
+    first_error = None
+    try:
+        futures = {
+            workers.submit(
+                figure_directory,
+                figure_options,
+                figbasename,
+                formats,
+                pixel_ratios,
+            ): (figure_directory, figure_options)
+            for (figure_directory, figbasename), figure_options in jobs.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            figure_directory, figure_options = futures[future]
+            seconds, failure = future.result()
+
+            # the render ran in a worker process, which records nothing itself
+            profiling.record("genfig.py.render", seconds)
+
+            error = None
+            if failure is not None:
+                error = RuntimeError(f"Could not render {figure_directory}:\n{failure}")
+                first_error = first_error or error
+
+            if progress is not None:
+                progress(
+                    done, len(jobs), figure_directory, figure_options, seconds, error
+                )
+    finally:
+        if owns_workers:
+            workers.close()
+
+    if first_error is not None:
+        raise first_error
+
+    return basenames
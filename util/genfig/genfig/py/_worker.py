@@ -0,0 +1,144 @@
+"""Provides `WorkerPool`, a pool of warm processes for rendering Python figures."""
+
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional
+
+# the number of seconds the worker spent importing the plotting libraries. Set in
+# each worker process by `_initialize_worker()`
+_startup_seconds = None
+
+
+def _initialize_worker():
+    """Imports the plotting libraries and loads matplotlib's font cache.
+
+    This is the bulk of the cost of rendering a small figure, so it is paid once per
+    worker, when the worker starts, rather than once per figure.
+
+    """
+    global _startup_seconds
+    start = time.perf_counter()
+
+    import numpy  # noqa: F401
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    from matplotlib import font_manager
+
+    # the font manager is loaded lazily; loading it reads (or builds) the font cache
+    font_manager.fontManager.findfont("DejaVu Sans")
+
+    _startup_seconds = time.perf_counter() - start
+
+
+def _run_job(*args):
+    """Renders a figure in a worker process.
+
+    Returns the worker's pid and startup time, the time the render took, and the
+    formatted traceback of the exception the render raised, if any. The traceback
+    is returned as text since the exceptions raised by figure scripts cannot always
+    be pickled.
+
+    """
+    from ._static import _render
+
+    start = time.perf_counter()
+    try:
+        _render(*args)
+        failure = None
+    except Exception:
+        failure = traceback.format_exc()
+    return os.getpid(), _startup_seconds, time.perf_counter() - start, failure
+
+
+class WorkerPool:
+    """A pool of long-lived processes that render Python figures.
+
+    Importing numpy and matplotlib and loading matplotlib's font cache takes far
+    longer than drawing a typical figure, so each worker does this once, when it
+    starts, and then renders many figures. Each figure's script is run in a fresh
+    namespace, and the worker closes every pyplot figure and restores matplotlib's
+    rcParams after each render so that one figure cannot affect the next. Modules
+    imported by the scripts stay loaded.
+
+    Workers are started lazily, on the first call to :meth:`submit`, and are
+    spawned rather than forked, since forking a process that is running threads (as
+    Sphinx and the JS figure server do) is unsafe. Spawned workers import the main
+    module of the process, so a script that starts a pool must guard its entry
+    point with `if __name__ == "__main__"`.
+
+    The pool can be used as a context manager, in which case it is closed on exit.
+
+    Parameters
+    ----------
+    size : int, optional
+        The number of worker processes. Default is None, in which case the number
+        of CPUs is used.
+
+    Attributes
+    ----------
+    startup_times : Dict[int, float]
+        The number of seconds each worker, by pid, spent importing the plotting
+        libraries. Workers are added once they have rendered a figure.
+
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        if size is not None and size < 1:
+            raise ValueError("The pool size must be at least 1.")
+
+        self.size = size if size is not None else os.cpu_count() or 1
+        self.startup_times: Dict[int, float] = {}
+
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, *args) -> Future:
+        """Renders a figure in one of the workers.
+
+        The arguments are those of `genfig.py._static._render`. The returned future
+        resolves to the time the render took along with the formatted traceback of
+        the exception it raised, or None.
+
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_initialize_worker,
+                )
+            job = self._executor.submit(_run_job, *args)
+
+        future = Future()
+
+        def record(job: Future):
+            try:
+                pid, startup_seconds, seconds, failure = job.result()
+            except BaseException as exc:
+                # e.g., the worker crashed
+                future.set_exception(exc)
+                return
+            self.startup_times[pid] = startup_seconds
+            future.set_result((seconds, failure))
+
+        job.add_done_callback(record)
+        return future
+
+    def close(self):
+        """Stops the workers, waiting for any renders in progress to finish."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,227 @@
+"""Vendors the third-party assets that the book and the figure previews load.
+
+The book's theme and the figure previews load Bootstrap, Bootstrap Icons, KaTeX and
+the Nunito font from CDNs. :func:`vendor_assets` downloads them, along with the
+fonts their stylesheets refer to, into /vis/js/lib/vendor so that they can be
+committed and served locally: the previews (and so the static renders) then never
+touch the network, and the book serves them from its own _static directory under
+content-hashed, cacheable names.
+
+"""
+
+import base64
+import hashlib
+import pathlib
+import posixpath
+import re
+import urllib.parse
+import urllib.request
+from typing import Callable, Dict, NamedTuple, Optional
+
+# the location of the vendored assets, relative to /vis/js
+VENDOR_DIRECTORY = pathlib.Path("lib/vendor")
+
+# Google Fonts serves different stylesheets to different browsers; this asks for
+# one that uses woff2 fonts
+_USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/124.0.0.0 Safari/537.36"
+)
+
+# matches the `url(...)` references in a stylesheet
+_CSS_URL_PATTERN = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+class VendoredAsset(NamedTuple):
+    """An asset loaded from a CDN and the path it is vendored at.
+
+    Attributes
+    ----------
+    url : str
+        The URL of the asset, as it appears in the templates.
+    path : str
+        The path of the vendored copy, relative to the vendor directory. The first
+        component names the package; the book fingerprints each package as a whole.
+    integrity : str, optional
+        The subresource integrity hash of the asset, if the templates pin one. The
+        download is checked against it.
+
+    """
+
+    url: str
+    path: str
+    integrity: Optional[str] = None
+
+
+_JSDELIVR = "https://cdn.jsdelivr.net/npm"
+
+VENDORED_ASSETS = [
+    VendoredAsset(
+        f"{_JSDELIVR}/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+        "bootstrap@5.3.3/dist/css/bootstrap.min.css",
+        "sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH",
+    ),
+    VendoredAsset(
+        f"{_JSDELIVR}/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+        "bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+        "sha384-YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz",
+    ),
+    VendoredAsset(
+        f"{_JSDELIVR}/bootstrap@5.3.3/dist/js/bootstrap.min.js",
+        "bootstrap@5.3.3/dist/js/bootstrap.min.js",
+        "sha384-0pUGZvbkm6XF6gxjEnlmuGrJXVbNuzT9qBBavbLwCsOGabYfZo0T0to5eqruptLy",
+    ),
+    VendoredAsset(
+        f"{_JSDELIVR}/@popperjs/core@2.11.8/dist/umd/popper.min.js",
+        "popperjs-core@2.11.8/dist/umd/popper.min.js",
+        "sha384-I7E8VVD/ismYTF4hNIPjVp/Zjvgyol6VFvRkX/vR+Vc4jQkC+hVqc2pM8ODewa9r",
+    ),
+    VendoredAsset(
+        f"{_JSDELIVR}/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css",
+        "bootstrap-icons@1.11.3/font/bootstrap-icons.min.css",
+    ),
+    VendoredAsset(
+        f"{_JSDELIVR}/katex@0.16.10/dist/katex.min.css",
+        "katex@0.16.10/dist/katex.min.css",
+        "sha384-wcIxkf4k558AjM3Yz3BBFQUbk/zgIYC2R0QpeeYb+TwlBVMrlgLqwRjRtGZiK7ww",
+    ),
+    VendoredAsset(
+        f"{_JSDELIVR}/katex@0.16.10/dist/katex.min.js",
+        "katex@0.16.10/dist/katex.min.js",
+        "sha384-hIoBPJpTUs74ddyc4bFZSM1TVlQDA60VBbJS0oA934VSz82sBx1X7kSx2ATBDIyd",
+    ),
+    VendoredAsset(
+        f"{_JSDELIVR}/katex@0.16.10/dist/contrib/auto-render.min.js",
+        "katex@0.16.10/dist/contrib/auto-render.min.js",
+        "sha384-43gviWU0YVjaDtb/GhzOouOXtZMP/7XUzwPTstBeZFe/+rCMvRwr4yROQP43s0Xk",
+    ),
+    VendoredAsset(
+        "https://fonts.googleapis.com/css2?family=Nunito:ital,wght@0,700;1,700"
+        "&display=swap",
+        "nunito/nunito.css",
+    ),
+]
+
+
+def vendored_path(vendor_directory: pathlib.Path, url: str) -> Optional[str]:
+    """The path of the vendored copy of the asset at `url`, if it has been vendored.
+
+    Parameters
+    ----------
+    vendor_directory : pathlib.Path
+        The directory the assets are vendored in; usually /vis/js/lib/vendor.
+    url : str
+        The URL of the asset, as in :data:`VENDORED_ASSETS`.
+
+    Returns
+    -------
+    Optional[str]
+        The path relative to `vendor_directory`, or None if the asset is unknown or
+        has not been downloaded.
+
+    """
+    for asset in VENDORED_ASSETS:
+        if asset.url == url and (vendor_directory / asset.path).is_file():
+            return asset.path
+    return None
+
+
+def _fetch(url: str) -> bytes:
+    request = urllib.request.Request(url, headers={"User-Agent": _USER_AGENT})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def _check_integrity(asset: VendoredAsset, content: bytes):
+    algorithm, _, expected = asset.integrity.partition("-")
+    digest = base64.b64encode(hashlib.new(algorithm, content).digest()).decode()
+    if digest != expected:
+        raise ValueError(f"{asset.url} does not match its integrity hash.")
+
+
+def _vendor_stylesheet_urls(
+    css_url: str,
+    css_path: str,
+    css: str,
+    fetch: Callable[[str], bytes],
+    files: Dict[str, bytes],
+) -> str:
+    """Downloads the files a stylesheet refers to, returning the stylesheet.
+
+    Relative references are stored at the same relative path, so the stylesheet is
+    unchanged. Absolute references (as Google Fonts makes) are stored in a fonts
+    directory beside the stylesheet, and the stylesheet is rewritten to match.
+
+    """
+
+    def replace(match: re.Match) -> str:
+        reference = match.group(2)
+        if reference.startswith("data:"):
+            return match.group(0)
+
+        url = urllib.parse.urljoin(css_url, reference)
+        location = urllib.parse.urlsplit(reference)
+        if location.scheme:
+            relative_path = "fonts/" + posixpath.basename(location.path)
+            replacement = f"url({relative_path})"
+        else:
+            # left untouched, so that the stylesheet still matches its integrity hash
+            relative_path = location.path
+            replacement = match.group(0)
+
+        path = posixpath.normpath(
+            posixpath.join(posixpath.dirname(css_path), relative_path)
+        )
+        if path not in files:
+            files[path] = fetch(url)
+        return replacement
+
+    return _CSS_URL_PATTERN.sub(replace, css)
+
+
+def vendor_assets(
+    vendor_directory: pathlib.Path, fetch: Callable[[str], bytes] = _fetch
+) -> Dict[str, int]:
+    """Downloads every asset in :data:`VENDORED_ASSETS` into the vendor directory.
+
+    Stylesheets are scanned for the fonts and images they refer to, which are
+    downloaded too. Each asset with an integrity hash is checked against it before
+    anything is written, so a failed run leaves the directory as it was.
+
+    Parameters
+    ----------
+    vendor_directory : pathlib.Path
+        The directory to vendor the assets in; usually /vis/js/lib/vendor.
+    fetch : Callable[[str], bytes], optional
+        Downloads a URL. Default is a function using urllib.
+
+    Returns
+    -------
+    Dict[str, int]
+        The size in bytes of each file written, by path relative to
+        `vendor_directory`.
+
+    Raises
+    ------
+    ValueError
+        If an asset does not match its integrity hash.
+
+    """
+    files = {}
+    for asset in VENDORED_ASSETS:
+        content = fetch(asset.url)
+        if asset.integrity is not None:
+            _check_integrity(asset, content)
+
+        if asset.path.endswith(".css"):
+            content = _vendor_stylesheet_urls(
+                asset.url, asset.path, content.decode(), fetch, files
+            ).encode()
+        files[asset.path] = content
+
+    for path, content in files.items():
+        destination = vendor_directory / path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        destination.write_bytes(content)
+
+    return {path: len(content) for path, content in files.items()}
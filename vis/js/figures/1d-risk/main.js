@@ -1,4 +1,10 @@
-import { Palette, Plot, PlotTeX, linspace } from "../../lib/ml4p/main.js";
+import {
+  Palette,
+  Plot,
+  PlotTeX,
+  linspace,
+  setupStatic,
+} from "../../lib/ml4p/main.js";
 
 function* cycle(iterable) {
   while (true) {
@@ -577,7 +583,10 @@ function configure_sketch(div_id, getTheme, opts = {}) {
 
 export function setup_dynamic(div_id, getTheme, opts) {
   let sketch = configure_sketch(div_id, getTheme, opts);
-  new p5(sketch, div_id);
+  return new p5(sketch, div_id);
 }
 
-export let setup_static = setup_dynamic;
+export function setup_static(div_id, getTheme, opts) {
+  let sketch = configure_sketch(div_id, getTheme, opts);
+  setupStatic(sketch, div_id);
+}
@@ -144,7 +144,7 @@ function configure_sketch(div_id, getTheme, opts) {
 
 export function setup_dynamic(div_id, getTheme, opts) {
   let sketch = configure_sketch(div_id, getTheme, opts);
-  new p5(sketch, div_id);
+  return new p5(sketch, div_id);
 }
 
 export let setup_static = setup_dynamic;
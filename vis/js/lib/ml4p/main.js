@@ -574,3 +574,186 @@ export class PlotTeX {
     element.position(this.page_x(x) + delta_x, this.page_y(y) + delta_y);
   }
 }
+
+/**
+ * Signals that a static figure is completely drawn. Static renderers (such as
+ * `genfig js generate-static`) wait for this signal before capturing the figure.
+ **/
+export function signalFrameDone() {
+  window.ml4pFrameDone = true;
+  document.dispatchEvent(new CustomEvent("ml4p-frame-done"));
+}
+
+/**
+ * Creates the p5 instance of a static figure. The sketch is drawn once, drawn
+ * again after the page's fonts have loaded (so that text and TeX labels are laid
+ * out correctly), and then stopped, at which point the frame is signalled as done.
+ * @param {function} sketch - The sketch, as would be passed to `new p5()`.
+ * @param {string} div_id - The id of the element that will contain the canvas.
+ * @returns {p5} The p5 instance.
+ */
+export function setupStatic(sketch, div_id) {
+  // lets static renderers know that this page will signal when it is done
+  window.ml4pSignalsFrameDone = true;
+
+  return new p5(function (p) {
+    sketch(p);
+
+    let draw = p.draw || function () {};
+    let stopped = false;
+    p.draw = function () {
+      draw();
+      if (stopped) {
+        return;
+      }
+
+      stopped = true;
+      p.noLoop();
+      document.fonts.ready.then(function () {
+        p.redraw();
+        signalFrameDone();
+      });
+    };
+  }, div_id);
+}
+
+// how far outside of the viewport a dynamic figure is mounted and kept running
+const DYNAMIC_MARGIN = "200px 0px";
+
+// the dynamic figures on the page, by the id of the element containing each
+let dynamicFigures = new Map();
+
+// the maximum number of dynamic figures that may be mounted at once
+let maxLiveFigures = Infinity;
+
+// watches the dynamic figures as they enter and leave the viewport
+let dynamicObserver = null;
+
+function pauseFigure(figure) {
+  let instance = figure.instance;
+  if (instance && !figure.paused && instance.isLooping()) {
+    instance.noLoop();
+    figure.paused = true;
+  }
+}
+
+function resumeFigure(figure) {
+  if (figure.instance && figure.paused) {
+    figure.instance.loop();
+    figure.paused = false;
+  }
+}
+
+/**
+ * Removes the least recently visible figures until at most `maxLiveFigures` are
+ * mounted. Removed figures lose their state and are mounted afresh when they
+ * approach the viewport again.
+ */
+function enforceMaxLiveFigures() {
+  let mounted = [...dynamicFigures.values()].filter((f) => f.instance);
+  let evictable = mounted
+    .filter((f) => !f.visible)
+    .sort((a, b) => a.lastVisible - b.lastVisible);
+
+  while (mounted.length > maxLiveFigures && evictable.length > 0) {
+    let figure = evictable.shift();
+    figure.instance.remove();
+    figure.instance = null;
+    figure.paused = false;
+    mounted.pop();
+  }
+}
+
+async function mountFigure(figure) {
+  figure.mounting = true;
+  let instance;
+  try {
+    instance = await figure.mount();
+  } finally {
+    figure.mounting = false;
+  }
+
+  // figures whose setup_dynamic() does not return their p5 instance are mounted
+  // lazily, but cannot be paused or removed
+  if (!instance || typeof instance.noLoop !== "function") {
+    figure.unmanaged = true;
+    return;
+  }
+
+  figure.instance = instance;
+  if (!figure.visible || document.hidden) {
+    pauseFigure(figure);
+  }
+  enforceMaxLiveFigures();
+}
+
+function onIntersection(entries) {
+  for (let entry of entries) {
+    let figure = dynamicFigures.get(entry.target.id);
+    figure.visible = entry.isIntersecting;
+    figure.lastVisible = performance.now();
+
+    if (!figure.visible) {
+      pauseFigure(figure);
+    } else if (figure.instance) {
+      if (!document.hidden) {
+        resumeFigure(figure);
+      }
+    } else if (!figure.mounting && !figure.unmanaged) {
+      mountFigure(figure);
+    }
+  }
+}
+
+function onVisibilityChange() {
+  for (let figure of dynamicFigures.values()) {
+    if (document.hidden) {
+      pauseFigure(figure);
+    } else if (figure.visible) {
+      resumeFigure(figure);
+    }
+  }
+}
+
+/**
+ * Mounts a dynamic figure once it approaches the viewport, and pauses its draw
+ * loop while it is offscreen or the page's tab is hidden.
+ * @param {string} div_id - The id of the element that will contain the figure.
+ * @param {function} mount - Creates the figure, returning (a promise of) its p5
+ * instance. Typically this imports the figure's module and calls its
+ * `setup_dynamic()`.
+ * @param {object} options - An object with optional parameters.
+ * @param {number} options.maxLive - The maximum number of dynamic figures on the
+ * page that may be mounted at once, or 0 for no limit. Beyond this, the figures
+ * that were least recently visible are removed. Applies to the whole page.
+ */
+export function mountDynamic(div_id, mount, { maxLive = 0 } = {}) {
+  if (maxLive > 0) {
+    maxLiveFigures = maxLive;
+  }
+
+  let figure = {
+    mount: mount,
+    instance: null,
+    mounting: false,
+    unmanaged: false,
+    paused: false,
+    visible: false,
+    lastVisible: 0,
+  };
+  dynamicFigures.set(div_id, figure);
+
+  if (typeof IntersectionObserver === "undefined") {
+    figure.visible = true;
+    mountFigure(figure);
+    return;
+  }
+
+  if (dynamicObserver === null) {
+    dynamicObserver = new IntersectionObserver(onIntersection, {
+      rootMargin: DYNAMIC_MARGIN,
+    });
+    document.addEventListener("visibilitychange", onVisibilityChange);
+  }
+  dynamicObserver.observe(document.getElementById(div_id));
+}